@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+#
+# Benchmark harness for the medusa multi worker super class.
+# Sweeps workloads, PROCESSES, scheduler and chunk settings and result collection paths,
+# reports throughput, p50/p99 task latency and peak RSS, and stores one json line per case
+# so that runs can be compared for regressions.
+#
+#    python3 medusa-bench.py --quick
+#    python3 medusa-bench.py --out before.jsonl
+#    python3 medusa-bench.py --out after.jsonl --compare before.jsonl
+#    python3 medusa-bench.py --cold-start
+#
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import resource
+import platform
+import contextlib
+import statistics
+import subprocess
+
+# Benchmark the working tree, not an installed medusa
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+LIB_DIR = sys.path[0]
+import medusa as mp  # noqa: E402
+
+SPIN_UNIT = 1000   # Loop iterations per unit of CPU work, about 30us
+
+
+def spin(units):
+   x = 0
+   for i in range(int(units * SPIN_UNIT)):
+      x += i * i
+   return x
+
+
+class BenchJob(mp.Medusa):
+   """
+      Base of the benchmark workloads, work(job) is the cost of one job.
+   """
+   NAME = 'bench'
+   JOBS = 1000
+
+   def __init__(self):
+      super().__init__()
+      self.PYMOD_NAME = 'MedusaBench-' + self.NAME
+
+   def get_config(self):
+      # Never prompt, the sweep sets PROCESSES
+      return {'processes': self.PROCESSES}
+
+   def jobs(self, scale):
+      return list(range(0, max(1, int(self.JOBS * scale))))
+
+   def work(self, job):
+      return job
+
+   def worker_custom(self, job_data):
+      if self.RESULTS_MODE == 'memory':
+         return [self.work(job) for job in job_data]
+      with self.result_writer() as w:
+         for job in job_data:
+            w.write(self.work(job))
+      return (os.getpid(), )
+
+
+class UniformCPU(BenchJob):
+   NAME = 'uniform_cpu'
+   JOBS = 2000
+
+   def work(self, job):
+      spin(1)
+      return job
+
+
+class HeavyTailCPU(BenchJob):
+   NAME = 'heavy_tail_cpu'
+   JOBS = 2000
+
+   def work(self, job):
+      # Pareto distributed cost, the same for a job in every run
+      spin(min(500.0, random.Random(job).paretovariate(1.2)))
+      return job
+
+
+class IOBound(BenchJob):
+   NAME = 'io_bound'
+   JOBS = 400
+
+   def work(self, job):
+      time.sleep(0.005)
+      return job
+
+
+class TinyJobs(BenchJob):
+   NAME = 'tiny_jobs'
+   JOBS = 100000
+
+
+class LargePayload(BenchJob):
+   NAME = 'large_payload'
+   JOBS = 500
+
+   def __init__(self):
+      super().__init__()
+      self.RESULT_FORMAT = 'pickle'
+
+   def work(self, job):
+      return bytes(64 * 1024)
+
+
+WORKLOADS = [UniformCPU, HeavyTailCPU, IOBound, TinyJobs, LargePayload]
+
+
+def peak_rss():
+   """
+      (parent, workers) peak resident bytes, workers are counted once their pool is closed.
+      Both are high-water marks of the whole process, run_isolated() gives every case its own.
+   """
+   return (
+      resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+      resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+   )
+
+
+def run_case(workload, scale, processes, scheduler, chunk_max, results_mode, out_dir,
+             backend=mp.BACKEND):
+   job = workload()
+   job.BACKEND = backend
+   job.PROCESSES = processes
+   job.SCHEDULER = scheduler
+   job.DISPATCH_CHUNK_MAX = chunk_max
+   job.RESULTS_MODE = results_mode
+   job.RESULTS_DIR = out_dir
+   job.RESULTS_FNAME = 'bench-' + workload.NAME
+   job.METRICS = 'jsonl'
+   job.METRICS_FILE = os.devnull
+   job_data = job.jobs(scale)
+   start = time.time()
+   with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+      job.orchestrate(processes=processes, job_index=job_data)
+   wall = time.time() - start
+   summary = job.metrics.summary()
+   if results_mode == 'file' and os.path.exists(job.results_file):
+      os.remove(job.results_file)
+   parent_rss, worker_rss = peak_rss()
+   return {
+      'bench': workload.NAME,
+      'backend': backend,
+      'jobs': job_data.__len__(),
+      'processes': processes,
+      'scheduler': scheduler,
+      'chunk_max': chunk_max,
+      'results_mode': results_mode,
+      'wall': wall,
+      'jobs_per_sec': job_data.__len__() / wall if wall > 0 else 0.0,
+      'tasks': summary['tasks'],
+      'latency_p50': summary['latency_p50'],
+      'latency_p99': summary['latency_p99'],
+      'rss_parent_peak': parent_rss,
+      'rss_worker_peak': max([w['rss_max'] for w in job.metrics.worker_records()] + [worker_rss]),
+   }
+
+
+def run_isolated(workload, scale, processes, scheduler, chunk_max, results_mode, out_dir,
+                 backend=mp.BACKEND):
+   """
+      run_case() in a fresh interpreter, so that the peak RSS of a case does not include the
+      cases before it.
+   """
+   case = {
+      'workload': workload.NAME, 'scale': scale, 'processes': processes,
+      'scheduler': scheduler, 'chunk_max': chunk_max, 'results_mode': results_mode,
+      'out_dir': out_dir, 'backend': backend
+   }
+   out = subprocess.run(
+      [sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)],
+      check=True, stdout=subprocess.PIPE
+   ).stdout
+   return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def cold_start(backends, processes, repeat):
+   """
+      Median seconds of `import medusa` in a fresh interpreter and of opening a pool of each
+      backend and running one task on every worker, the cost every CLI call and run pays first.
+   """
+   imports = []
+   for i in range(repeat):
+      start = time.time()
+      subprocess.run([sys.executable, '-c', 'import medusa'], cwd=LIB_DIR, check=True)
+      imports.append(time.time() - start)
+   records = [{'type': 'cold_start', 'stage': 'import', 'seconds': statistics.median(imports)}]
+   for backend in backends:
+      if backend == 'distributed':
+         continue
+      spawns = []
+      for i in range(repeat):
+         job = BenchJob()
+         job.BACKEND = backend
+         job.PROCESSES = processes
+         start = time.time()
+         with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+            with job.open(processes):
+               job.orchestrate(processes=processes, job_index=list(range(processes)))
+         spawns.append(time.time() - start)
+         if os.path.exists(job.results_file):
+            os.remove(job.results_file)
+      records.append({
+         'type': 'cold_start', 'stage': 'pool', 'backend': backend, 'processes': processes,
+         'seconds': statistics.median(spawns)
+      })
+   return records
+
+
+def case_key(record):
+   return (
+      record['bench'], record.get('backend', 'process'), record['jobs'], record['processes'],
+      record['scheduler'], record['chunk_max'], record['results_mode']
+   )
+
+
+def load(path):
+   with open(path) as r:
+      return [json.loads(line) for line in r if line.strip() and '"bench"' in line]
+
+
+def compare(records, baseline, threshold):
+   """
+      Print throughput against a baseline run, returns the number of regressions.
+   """
+   previous = dict((case_key(r), r) for r in baseline)
+   regressions = 0
+   print('%-16s %-7s %6s %3s %-8s %5s %-7s %12s %12s %8s' % (
+      'bench', 'backend', 'jobs', 'p', 'sched', 'chunk', 'results', 'base jobs/s', 'jobs/s',
+      'change'
+   ))
+   for record in records:
+      base = previous.get(case_key(record))
+      if base is None or not base['jobs_per_sec']:
+         continue
+      change = record['jobs_per_sec'] / base['jobs_per_sec'] - 1.0
+      flag = ''
+      if change < -threshold:
+         flag = '  REGRESSION'
+         regressions = regressions + 1
+      print('%-16s %-7s %6s %3s %-8s %5s %-7s %12.1f %12.1f %+7.1f%%%s' % (
+         case_key(record) + (base['jobs_per_sec'], record['jobs_per_sec'], change * 100, flag)
+      ))
+   return regressions
+
+
+def main():
+   parser = argparse.ArgumentParser(description='Benchmark medusa scheduling and result paths.')
+   parser.add_argument('--quick', action='store_true', help='Run a tenth of the jobs.')
+   parser.add_argument(
+      '--processes', default='1,%s' % (os.cpu_count() or 1),
+      help='Comma separated PROCESSES values to sweep.'
+   )
+   parser.add_argument(
+      '--workloads', default=','.join(w.NAME for w in WORKLOADS),
+      help='Comma separated workloads to run.'
+   )
+   parser.add_argument('--backends', default=mp.BACKEND, help='Comma separated BACKEND values.')
+   parser.add_argument('--schedulers', default=','.join(mp.SCHEDULERS))
+   parser.add_argument('--chunks', default='100,10', help='DISPATCH_CHUNK_MAX values, dynamic.')
+   parser.add_argument('--results-modes', default='file,memory', help='RESULTS_MODE values.')
+   parser.add_argument('--out', default='medusa-bench-%s.jsonl' % time.strftime('%Y%m%d-%H%M%S'))
+   parser.add_argument('--compare', help='Baseline jsonl from an earlier run.')
+   parser.add_argument('--threshold', type=float, default=0.10, help='Regression threshold.')
+   parser.add_argument(
+      '--cold-start', action='store_true',
+      help='Only time import medusa and pool start up against the budgets.'
+   )
+   parser.add_argument('--import-budget', type=float, default=0.25, help='Seconds, import.')
+   parser.add_argument('--pool-budget', type=float, default=1.0, help='Seconds, pool start up.')
+   parser.add_argument('--case', help=argparse.SUPPRESS)
+   args = parser.parse_args()
+
+   if args.case:
+      # One case of the sweep, run by run_isolated() in its own interpreter
+      case = json.loads(args.case)
+      name = case.pop('workload')
+      workload = [w for w in WORKLOADS if w.NAME == name][0]
+      print(json.dumps(run_case(workload, **case)))
+      return
+
+   if args.cold_start:
+      processes = int(args.processes.split(',')[-1])
+      records = cold_start(args.backends.split(','), processes, 5)
+      over = 0
+      with open(args.out, 'a') as w:
+         for record in records:
+            budget = args.import_budget if record['stage'] == 'import' else args.pool_budget
+            record['budget'] = budget
+            w.write(json.dumps(record) + '\n')
+            flag = ''
+            if record['seconds'] > budget:
+               flag = '  OVER BUDGET'
+               over = over + 1
+            print('%-7s %-8s %8.3fs budget %6.3fs%s' % (
+               record['stage'], record.get('backend', ''), record['seconds'], budget, flag
+            ))
+      print('Results stored in %s' % args.out)
+      if over:
+         sys.exit(1)
+      return
+
+   scale = 0.1 if args.quick else 1.0
+   names = args.workloads.split(',')
+   workloads = [w for w in WORKLOADS if w.NAME in names]
+   out_dir = mp.TEMP
+   records = []
+   meta = {
+      'type': 'meta', 'time': time.time(), 'python': platform.python_version(),
+      'machine': platform.machine(), 'cpus': os.cpu_count(), 'quick': args.quick,
+   }
+   with open(args.out, 'a') as w:
+      w.write(json.dumps(meta) + '\n')
+      cases = [
+         (workload, backend, int(processes), scheduler, results_mode)
+         for workload in workloads
+         for backend in args.backends.split(',')
+         for processes in args.processes.split(',')
+         for scheduler in args.schedulers.split(',')
+         for results_mode in args.results_modes.split(',')
+      ]
+      for workload, backend, processes, scheduler, results_mode in cases:
+         chunks = [int(c) for c in args.chunks.split(',')]
+         if scheduler == 'static':
+            chunks = chunks[:1]
+         for chunk_max in chunks:
+            record = run_isolated(
+               workload, scale, processes, scheduler, chunk_max, results_mode, out_dir, backend
+            )
+            records.append(record)
+            w.write(json.dumps(record) + '\n')
+            w.flush()
+            print(
+               '%-16s %-7s jobs=%-6s p=%-3s %-7s chunk=%-4s %-6s %10.1f jobs/s '
+               'p50=%.4fs p99=%.4fs rss=%.0fMB' % (
+                  record['bench'], backend, record['jobs'], processes, scheduler, chunk_max,
+                  results_mode, record['jobs_per_sec'], record['latency_p50'],
+                  record['latency_p99'], record['rss_worker_peak'] / 1048576.0
+               )
+            )
+   print('Results stored in %s' % args.out)
+
+   if args.compare:
+      regressions = compare(records, load(args.compare), args.threshold)
+      if regressions:
+         print('%s cases regressed by more than %.0f%%' % (regressions, args.threshold * 100))
+         sys.exit(1)
+
+
+if __name__ == '__main__':
+   main()
@@ -34,8 +34,10 @@ class BatchCalculateJob(mp.Medusa):
       """ Mandatory overriden procedure.
           We override this for custom instance processing.
       """
-      pid = os.getpid()
-      wname = TEMP + '/worker.%s' % pid
+      # Each worker has its own temp file, use shard_path() rather than the pid as
+      # thread workers (BACKEND = 'thread') share one process
+      pid = self.worker_id()
+      wname = self.shard_path()
       print('Starting worker file %s...' % wname)
 
       # We open a file and can write our results here for later joining
@@ -6,71 +6,2176 @@
 #
 import sys
 import os
+import io
 import time
-import logging
-import tempfile
-# import json
-import yaml
+import getpass
 import glob
+import math
+import ast
+import struct
+import pickle
+import array
+import functools
+import itertools
+import queue
+import signal
+import json
+import random
+import resource
+import collections
+import threading
+import hashlib
+import fcntl
 import traceback
-import rlab_common as rlc
 import multiprocessing as mp
 
 DEBUG = False
 VERBOSE = False
 
+# Importing medusa does no filesystem work, modules only some runs need (yaml, asyncio,
+# rlab_common, the distributed transport) are imported where they are used. Workers and CLI
+# invocations start with no more than the standard library core.
+
+# Number of processes to run in parallel
+PROCESSES = 1
+WORKER_TIMEOUT = 3600   # In Seconds - 1 hour - any more means you are too course grained!
+WORKER_EXIT_ON_TIMEOUT = True
 # Temp folder, is needed for temporary files created by parallel processes
-TEMP = tempfile.mkdtemp()
+TEMP = '/tmp'
+PYMOD_NAME = 'worker-template'
+# None - 'results-' + PYMOD_NAME + '-' + the login name, looked up when a job is created
+RESULTS_FNAME = None
+RESULTS_DIR = TEMP
+CONFIG_FNAME = PYMOD_NAME + '.yaml'
+
+# Scheduling - 'static' splits job_index into PROCESSES chunks up front and runs them in
+# barrier separated batches, 'dynamic' feeds small tasks to workers as they become idle.
+SCHEDULERS = ('static', 'dynamic')
+SCHEDULER = 'static'
+DISPATCH_CHUNK_MIN = 1     # Smallest task handed to a worker by the dynamic scheduler
+DISPATCH_CHUNK_MAX = 100   # Largest task handed to a worker by the dynamic scheduler
+DISPATCH_GUIDED_FACTOR = 4  # Task size = remaining / (factor * processes)
+DISPATCH_PREFETCH = 2      # Tasks queued per process so a worker never waits for the parent
+
+# Partitioning - 'count' balances jobs by number after a shuffle, 'lpt' balances by
+# job_weight(), longest first, on the dynamic scheduler. LEARN_WEIGHTS records per job seconds in
+# RESULTS_DIR/RESULTS_FNAME.weights and uses them as the default job_weight() of later runs.
+PARTITIONERS = ('count', 'lpt')
+PARTITIONER = 'count'
+LEARN_WEIGHTS = False
+
+# Autotuning - with AUTOTUNE the dynamic scheduler starts from os.cpu_count() workers and
+# spends up to AUTOTUNE_WARMUP of the jobs trying task sizes AUTOTUNE_CHUNKS, then fewer
+# workers, AUTOTUNE_SAMPLES tasks per worker each, and keeps the fastest for the rest of the
+# run. The winner is stored per PYMOD_NAME in AUTOTUNE_FILE, later runs start from it.
+AUTOTUNE = False
+AUTOTUNE_FILE = '~/.medusa-autotune.yaml'
+AUTOTUNE_WARMUP = 0.2
+AUTOTUNE_CHUNKS = (1, 4, 16, 64, 256)
+AUTOTUNE_SAMPLES = 2
+
+# Result record formats - 'text' is the ',\n' joined json list, the binary formats write
+# length prefixed frames that are read back one record at a time with iter_results().
+RESULT_FORMATS = ('text', 'pickle', 'msgpack')
+RESULT_FORMAT = 'text'
+RESULT_EXTENSIONS = {'text': '.json', 'pickle': '.pickle', 'msgpack': '.msgpack'}
+PICKLE_PROTOCOL = min(5, pickle.HIGHEST_PROTOCOL)
+
+# Result compression - None, 'gzip', 'zstd' (zstandard package) or 'lz4' (lz4 package) in
+# file mode. Every result_writer() compresses its records into one frame of the worker shard
+# as they are written. Frames concatenate, so the results file is the shards copied back to
+# back unchanged and is read back as one stream. RESULT_COMPRESSION_LEVEL None is the codec
+# default. Compressed text records lead with their ',\n' separator, the merge recompresses the
+# first task's frame without it so that the results stay a json list.
+RESULT_COMPRESSIONS = (None, 'gzip', 'zstd', 'lz4')
+RESULT_COMPRESSION = None
+RESULT_COMPRESSION_LEVEL = None
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst', 'lz4': '.lz4'}
+
+# Result channel - 'file' workers write shards in TEMP, 'memory' worker_custom returns or
+# yields its records and they are collected in the parent as self.results, spooled to an
+# anonymous temp file once they pass RESULTS_MEMORY_LIMIT bytes. 'reduce' aggregates
+# map(job) values with combine() inside each task and the parent folds the partial aggregate
+# of every task into self.reduced with reduce() as it arrives.
+RESULTS_MODES = ('file', 'memory', 'reduce')
+RESULTS_MODE = 'file'
+RESULTS_MEMORY_LIMIT = 256 * 1024 * 1024
+
+# Pipelines - the records of every Pipeline stage but the last stream into the next stage
+# through a buffer of PIPELINE_BUFFER records. A full buffer holds the upstream stage back, or
+# with PIPELINE_SPILL the overflow is spooled to an anonymous temp file in TEMP.
+PIPELINE_BUFFER = 10000
+PIPELINE_SPILL = False
+
+# Failure handling - with JOURNAL every completed task is logged to
+# RESULTS_DIR/RESULTS_FNAME.journal so that orchestrate(resume=True) only runs what is left.
+# A failed task is resubmitted up to TASK_RETRIES times before it is given up.
+JOURNAL = False
+TASK_RETRIES = 0
+
+# Stragglers - TASK_TIMEOUT bounds every task inside its worker (None is unbounded). With
+# SPECULATIVE the dynamic scheduler copies a task that has run SPECULATIVE_FACTOR times the
+# median task duration onto an idle worker, the first copy to finish wins and the other is
+# cancelled.
+TASK_TIMEOUT = None
+SPECULATIVE = False
+SPECULATIVE_FACTOR = 3.0
+SPECULATIVE_MIN_SAMPLES = 5
+SPECULATIVE_INTERVAL = 0.5   # Seconds between straggler checks
+CANCEL_SLOTS = 64            # Recently cancelled attempts visible to workers
+
+# Metrics - None, 'jsonl' or 'prometheus'. Workers measure every task, the parent aggregates
+# per task latency, per worker busy/idle time, CPU and RSS, throughput and queue depth and
+# writes them to METRICS_FILE (default RESULTS_DIR/RESULTS_FNAME.metrics.jsonl or .prom)
+# when the run is cleaned up. With VERBOSE the jsonl file also gets one line per task.
+METRICS_FORMATS = (None, 'jsonl', 'prometheus')
+METRICS = None
+METRICS_FILE = None
+METRICS_SAMPLES = 10000      # Task latencies kept for percentiles, reservoir sampled
+
+# Memory - process workers exit at a task boundary after WORKER_MAX_TASKS tasks or once their
+# resident memory passes WORKER_RSS_LIMIT bytes, the pool starts a fresh worker in their place.
+# Both take effect from open(). While system available memory is below MEMORY_MIN_AVAILABLE
+# bytes the dynamic scheduler holds back new tasks until running ones complete.
+WORKER_MAX_TASKS = None
+WORKER_RSS_LIMIT = None
+MEMORY_MIN_AVAILABLE = None
+
+# Placement - AFFINITY 'core' pins every process worker to one CPU, 'node' to the CPUs of one
+# NUMA node as listed in /sys/devices/system/node. PLACEMENT 'spread' deals the workers round
+# robin over the nodes, 'pack' fills a node before the next. With NUMA_SHARED share() keeps one
+# copy per node, first touched from that node, and placed workers read their local copy.
+AFFINITIES = (None, 'core', 'node')
+AFFINITY = None
+PLACEMENTS = ('spread', 'pack')
+PLACEMENT = 'spread'
+NUMA_SHARED = False
+FRAME = struct.Struct('<I')   # Record length prefix, little endian uint32
+
+# Result merge - shards are copied into the results file at precomputed offsets, in the kernel
+# with copy_file_range where possible, by MERGE_THREADS threads at a time.
+MERGE_BLOCK_SIZE = 1024 * 1024
+MERGE_THREADS = 1
+
+# Async workers - with ASYNC_WORKERS every pool process runs an event loop and the jobs of a
+# task are awaited as worker_custom_async(job) coroutines, at most ASYNC_CONCURRENCY at a
+# time per process, for jobs that mostly wait on the network or disk.
+ASYNC_WORKERS = False
+ASYNC_CONCURRENCY = 64
+
+# Result cache - with CACHE the output of every job is stored in CACHE_DIR (default
+# RESULTS_DIR/RESULTS_FNAME.cache) under a hash of job_key(job), the code of the worker hooks,
+# cache_config() and CACHE_VERSION. Later runs serve cached jobs without dispatching them,
+# least recently used entries are evicted past CACHE_SIZE bytes.
+CACHE = False
+CACHE_DIR = None
+CACHE_SIZE = 1024 * 1024 * 1024
+CACHE_VERSION = None
+
+# Incremental runs - with INCREMENTAL (file mode) RESULTS_DIR/RESULTS_FNAME.manifest maps the
+# job_key() of every processed job to its job_fingerprint() and the byte range of its output
+# in an append only part file under RESULTS_DIR/RESULTS_FNAME.parts. Later runs only dispatch
+# new or changed jobs and append their output as a new part. Parts are compacted once more
+# than INCREMENTAL_COMPACT of their bytes belong to dropped or replaced jobs.
+INCREMENTAL = False
+INCREMENTAL_COMPACT = 0.5
+
+# Batch mode - with BATCH_MODE a numeric job_index (numpy array, array.array or a list of
+# ints or floats) is stored once as a contiguous array in shared memory under BATCH_JOBS,
+# tasks are JobSlice bounds into it and workers get zero copy array slices in
+# worker_batch(). Batches are cut by the dynamic scheduler, in job_index order.
+BATCH_MODE = False
+BATCH_JOBS = '__jobs__'
+
+# Attributes that travel with every task and are applied to the worker resident instance, so
+# that a pool opened earlier still follows the settings of the current run
+WORKER_SETTINGS = (
+   'TEMP', 'RESULT_FORMAT', 'RESULTS_MODE', 'SHARED', 'ASYNC_WORKERS', 'ASYNC_CONCURRENCY',
+   'cache_path', 'cache_namespace', 'incremental', 'WORKER_MAX_TASKS', 'WORKER_RSS_LIMIT',
+   'RESULT_COMPRESSION', 'RESULT_COMPRESSION_LEVEL'
+)
+
+# Executor backend - 'process' runs workers in a multiprocessing pool, 'thread' in a thread
+# pool of the parent for work that releases the GIL or a free-threaded build, 'serial' runs
+# every task in the calling thread as a debugging aid and overhead free baseline,
+# 'distributed' serves tasks to remote agents. Task timeouts and speculative copies are
+# signal based and need the 'process' backend.
+BACKENDS = ('process', 'thread', 'serial', 'distributed')
+BACKEND = 'process'
+
+# Distributed - the orchestrating instance listens on DISTRIBUTED_ADDRESS and
+# `medusa worker --connect host:port` agents on other nodes run its tasks in their own
+# process pools and stream the results back. Connections are authenticated with
+# DISTRIBUTED_AUTHKEY or else $MEDUSA_AUTHKEY, neither side starts without one as tasks are
+# pickles. The coordinator only listens on localhost unless DISTRIBUTED_ADDRESS says otherwise.
+# An agent silent for HEARTBEAT_TIMEOUT seconds is dropped and its tasks are requeued.
+DISTRIBUTED_ADDRESS = ('127.0.0.1', 7077)
+DISTRIBUTED_AUTHKEY = None
+HEARTBEAT_INTERVAL = 2.0
+HEARTBEAT_TIMEOUT = 10.0
+
+POOL = None
+
+# The Medusa instance that owns the pool, installed once per worker process by the pool
+# initializer so that tasks do not have to ship the instance with every call.
+_WORKER = None
+
+# Shared memory segments attached by this process, by segment name
+_SHARED_SEGMENTS = {}
+
+# Worker side task tracking - the attempt running in this process, the queue task start
+# events go to, and the ring of attempt ids the parent has cancelled
+_ATTEMPT = None
+_EVENTS = None
+_CANCELLED = None
+
+# Tasks run by this worker process and whether it exits once the current task is returned
+_TASKS = 0
+_RECYCLE = False
+_TASK_BUDGET_OK = None   # Parent side result of _task_budget_works()
+
+# NUMA node this worker process was placed on, None when it is not pinned
+_NODE = None
+
+# Event loop of this worker thread in async mode
+_LOCAL = threading.local()
+
+
+class SerialResult(object):
+   """
+      The AsyncResult of a task SerialPool has already run.
+   """
+   def __init__(self, func, args=(), kwds={}, callback=None, error_callback=None):
+      try:
+         self.__value = func(*args, **kwds)
+         self.__success = True
+      except Exception as e:
+         self.__value = e
+         self.__success = False
+      if self.__success and callback is not None:
+         callback(self.__value)
+      if not self.__success and error_callback is not None:
+         error_callback(self.__value)
+
+   def ready(self):
+      return True
+
+   def successful(self):
+      return self.__success
+
+   def wait(self, timeout=None):
+      pass
+
+   def get(self, timeout=None):
+      if self.__success:
+         return self.__value
+      raise self.__value
+
+
+class SerialPool(object):
+   """
+      multiprocessing.Pool look alike that runs every task in the calling thread as it is
+      submitted, no pickling, no IPC, and a debugger can step into worker_custom.
+   """
+   def __init__(self, processes=1, initializer=None, initargs=()):
+      if initializer is not None:
+         initializer(*initargs)
+
+   def apply_async(self, func, args=(), kwds={}, callback=None, error_callback=None):
+      return SerialResult(func, args, kwds, callback, error_callback)
+
+   def map_async(self, func, iterable, chunksize=None, callback=None, error_callback=None):
+      return SerialResult(lambda: [func(item) for item in iterable], (), {}, callback,
+                          error_callback)
+
+   def apply(self, func, args=(), kwds={}):
+      return self.apply_async(func, args, kwds).get()
+
+   def map(self, func, iterable, chunksize=None):
+      return self.map_async(func, iterable).get()
+
+   def close(self):
+      pass
+
+   def terminate(self):
+      pass
+
+   def join(self):
+      pass
+
+
+class DistributedResult(object):
+   """
+      The AsyncResult of a task handed to DistributedPool, set when an agent reports back.
+   """
+   def __init__(self, callback=None, error_callback=None):
+      self.__callback = callback
+      self.__error_callback = error_callback
+      self.__event = threading.Event()
+      self.__value = None
+      self.__success = None
+
+   def set(self, success, value):
+      self.__value = value
+      self.__success = success
+      self.__event.set()
+      if success and self.__callback is not None:
+         self.__callback(value)
+      if not success and self.__error_callback is not None:
+         self.__error_callback(value)
+
+   def ready(self):
+      return self.__event.is_set()
+
+   def successful(self):
+      if not self.ready():
+         raise ValueError('%r not ready' % self)
+      return self.__success
+
+   def wait(self, timeout=None):
+      self.__event.wait(timeout)
+
+   def get(self, timeout=None):
+      if not self.__event.wait(timeout):
+         raise mp.TimeoutError()
+      if self.__success:
+         return self.__value
+      raise self.__value
+
+
+def _read_range(path, start, end):
+   fd = os.open(path, os.O_RDONLY)
+   try:
+      return os.pread(fd, end - start, start)
+   finally:
+      os.close(fd)
+
+
+def _ship_result(result, shards):
+   """
+      Agent side, attach the shard bytes a task wrote to its (pid, value, segment, stats)
+      result, the pid becomes host-pid so that workers of different agents do not collide.
+   """
+   import socket
+   pid, value, segment, stats = result
+   data = None
+   if segment is not None:
+      shard, start, end = segment
+      shards.add(shard)
+      data = _read_range(shard, start, end)
+   return ('%s-%s' % (socket.gethostname(), pid), value, segment, stats, data)
+
+
+def _land_result(result):
+   """
+      Coordinator side, append the shipped shard bytes to a local shard of the remote worker
+      and point the segment at them.
+   """
+   pid, value, segment, stats, data = result
+   if segment is not None:
+      shard = os.path.join(os.path.dirname(segment[0]), 'worker.%s' % pid)
+      start = _file_size(shard)
+      with open(shard, 'ab') as w:
+         w.write(data)
+      segment = (shard, start, start + data.__len__())
+   return (pid, value, segment, stats)
+
+
+class DistributedPool(object):
+   """
+      multiprocessing.Pool look alike that serves its tasks over TCP to worker agents, see
+      run_agent(). Every agent runs the pool initializer in its own process pool and keeps
+      up to two tasks per process in flight. Tasks of an agent that disconnects or misses
+      heartbeats for HEARTBEAT_TIMEOUT seconds are requeued for the others.
+   """
+   def __init__(self, processes=1, initializer=None, initargs=(), address=DISTRIBUTED_ADDRESS,
+                authkey=DISTRIBUTED_AUTHKEY):
+      import socket
+      self.processes = processes
+      self.requeued = 0
+      self.__initializer = initializer
+      self.__initargs = initargs
+      self.__authkey = get_authkey(authkey)
+      self.__tasks = queue.Queue()
+      self.__results = {}
+      self.__counter = itertools.count()
+      self.__closed = threading.Event()
+      self.__agents = []
+      self.__socket = socket.create_server(tuple(address))
+      self.__socket.settimeout(0.5)
+      self.address = self.__socket.getsockname()
+      self.__acceptor = threading.Thread(target=self.__accept, daemon=True)
+      self.__acceptor.start()
+      print('MEDUSA: INFO: Coordinator waiting for worker agents on %s:%s' % self.address[:2])
+
+   def __accept(self):
+      import socket
+      from multiprocessing import connection
+      while not self.__closed.is_set():
+         try:
+            sock = self.__socket.accept()[0]
+         except socket.timeout:
+            continue
+         except OSError:
+            break
+         sock.settimeout(None)
+         agent = threading.Thread(
+            target=self.__serve, args=(connection.Connection(sock.detach()), ), daemon=True
+         )
+         agent.start()
+         self.__agents.append(agent)
+
+   def __serve(self, conn):
+      from multiprocessing import connection
+      inflight = {}
+      name = 'unknown'
+      try:
+         # The same handshake as multiprocessing.connection.Listener
+         connection.deliver_challenge(conn, self.__authkey)
+         connection.answer_challenge(conn, self.__authkey)
+         kind, host, pid, processes = conn.recv()
+         name = '%s:%s' % (host, pid)
+         conn.send(('init', self.__initializer, self.__initargs))
+         print('MEDUSA: INFO: Worker agent %s joined with %s processes.' % (name, processes))
+         slots = 2 * int(processes)
+         heard = time.time()
+         while not self.__closed.is_set():
+            while inflight.__len__() < slots:
+               try:
+                  task = self.__tasks.get_nowait()
+               except queue.Empty:
+                  break
+               inflight[task[0]] = task
+               conn.send(('task', ) + task)
+            if conn.poll(0.05):
+               message = conn.recv()
+               heard = time.time()
+               if message[0] == 'done':
+                  task_id, success, value = message[1:]
+                  inflight.pop(task_id, None)
+                  self.__finish(task_id, success, value)
+            elif time.time() - heard > HEARTBEAT_TIMEOUT:
+               raise EOFError('No heartbeat for %ss' % HEARTBEAT_TIMEOUT)
+         conn.send(('close', ))
+      except (EOFError, OSError, mp.AuthenticationError) as e:
+         if inflight:
+            print(
+               'MEDUSA: WARNING: Worker agent %s lost, requeueing %s tasks. ERR - %s' % (
+                  name, inflight.__len__(), e
+               )
+            )
+         for task in inflight.values():
+            self.requeued = self.requeued + 1
+            self.__tasks.put(task)
+      finally:
+         conn.close()
+
+   def __finish(self, task_id, success, value):
+      result = self.__results.pop(task_id, None)
+      if result is None:
+         return
+      if success:
+         try:
+            value = _land_result(value)
+         except Exception as e:
+            success, value = False, e
+      result.set(success, value)
+
+   def apply_async(self, func, args=(), kwds={}, callback=None, error_callback=None):
+      task_id = next(self.__counter)
+      result = DistributedResult(callback, error_callback)
+      self.__results[task_id] = result
+      self.__tasks.put((task_id, func, args, kwds))
+      return result
+
+   def map_async(self, func, iterable, chunksize=None, callback=None, error_callback=None):
+      items = list(iterable)
+      out = [None] * items.__len__()
+      result = DistributedResult(callback, error_callback)
+      left = [items.__len__()]
+      lock = threading.Lock()
+
+      def done(index, value):
+         with lock:
+            out[index] = value
+            left[0] = left[0] - 1
+            if left[0] == 0:
+               result.set(True, out)
+
+      def failed(e):
+         with lock:
+            if not result.ready():
+               result.set(False, e)
+
+      if not items:
+         result.set(True, out)
+      for index, item in enumerate(items):
+         self.apply_async(func, (item, ), {}, functools.partial(done, index), failed)
+      return result
+
+   def apply(self, func, args=(), kwds={}):
+      return self.apply_async(func, args, kwds).get()
+
+   def map(self, func, iterable, chunksize=None):
+      return self.map_async(func, iterable).get()
+
+   def close(self):
+      self.__closed.set()
+      self.__socket.close()
+
+   def terminate(self):
+      self.close()
+
+   def join(self):
+      self.__acceptor.join()
+      for agent in self.__agents:
+         agent.join()
+
+
+def get_authkey(authkey=None):
+   """
+      The authkey of the distributed backend, authkey or else $MEDUSA_AUTHKEY, as bytes. There
+      is no default key, whoever knows it can run code on both sides through the task pickles.
+   """
+   authkey = authkey or os.environ.get('MEDUSA_AUTHKEY')
+   if not authkey:
+      raise ValueError('The distributed backend needs DISTRIBUTED_AUTHKEY or $MEDUSA_AUTHKEY.')
+   return authkey.encode() if isinstance(authkey, str) else authkey
+
+
+def run_agent(address, authkey=DISTRIBUTED_AUTHKEY, processes=None, linger=None):
+   """
+      Worker agent of a distributed coordinator, see DistributedPool. Connects to address,
+      runs the tasks it is sent in a pool of processes and sends back the results with the
+      shard bytes they wrote. Reconnects when the coordinator closes its pool, returns once
+      no coordinator could be reached for linger seconds (None waits forever).
+   """
+   from multiprocessing import connection
+   authkey = get_authkey(authkey)
+   processes = int(processes or os.cpu_count() or 1)
+   waiting = time.time()
+   while True:
+      try:
+         conn = connection.Client(tuple(address), authkey=authkey)
+      except (OSError, EOFError):
+         if linger is not None and time.time() - waiting > linger:
+            return
+         time.sleep(1)
+         continue
+      try:
+         _serve_agent(conn, processes)
+      finally:
+         waiting = time.time()
+
+
+def _serve_agent(conn, processes):
+   import socket
+   lock = threading.Lock()
+   stop = threading.Event()
+   shards = set()
+   folders = set()
+
+   def send(message):
+      with lock:
+         conn.send(message)
+
+   def reply(task_id, success, value):
+      if success:
+         try:
+            value = _ship_result(value, shards)
+         except Exception as e:
+            success, value = False, e
+      if not success:
+         try:
+            pickle.dumps(value)
+         except Exception:
+            # Exceptions that do not pickle still reach the coordinator as text
+            value = RuntimeError('%s: %s' % (type(value).__name__, value))
+      try:
+         send(('done', task_id, success, value))
+      except OSError:
+         pass
+
+   def heartbeat():
+      while not stop.wait(HEARTBEAT_INTERVAL):
+         try:
+            send(('heartbeat', ))
+         except OSError:
+            break
+
+   send(('hello', socket.gethostname(), os.getpid(), processes))
+   kind, initializer, initargs = conn.recv()
+   pool = mp.Pool(processes, initializer, initargs)
+   beat = threading.Thread(target=heartbeat, daemon=True)
+   beat.start()
+   print('MEDUSA: INFO: Worker agent %s serving with %s processes.' % (os.getpid(), processes))
+   try:
+      while True:
+         message = conn.recv()
+         if message[0] != 'task':
+            break
+         task_id, func, args, kwds = message[1:]
+         # Shards go to the coordinator's TEMP path, make sure it exists on this node
+         folder = getattr(func, 'keywords', {}).get('settings', {}).get('TEMP')
+         if folder and folder not in folders:
+            os.makedirs(folder, exist_ok=True)
+            folders.add(folder)
+         pool.apply_async(
+            func, args, kwds, callback=functools.partial(reply, task_id, True),
+            error_callback=functools.partial(reply, task_id, False)
+         )
+   except (EOFError, OSError):
+      pass
+   finally:
+      stop.set()
+      pool.terminate()
+      pool.join()
+      conn.close()
+      for shard in shards:
+         if os.path.exists(shard):
+            os.remove(shard)
+
+
+class Autotuner(object):
+   """
+      Warm-up search of the dynamic scheduler for the (processes, chunk) with the highest job
+      throughput. Task sizes are tried first with every worker, then fewer workers with the
+      best task size. A candidate is timed from its first task submitted to its last of
+      samples * processes tasks completed, tasks cut for an earlier candidate do not count.
+      settings holds the winner once the search is over, skipped the candidates that were
+      never timed.
+   """
+   def __init__(self, processes, chunks, samples, budget=None):
+      self.processes = processes
+      self.samples = samples
+      self.budget = budget
+      self.candidates = [(processes, int(chunk)) for chunk in chunks]
+      self.workers = sorted(set(max(1, processes // d) for d in (2, 4)) - set([processes]))
+      self.workers.reverse()
+      self.results = {}
+      self.skipped = []
+      self.settings = None
+      self.jobs_seen = 0
+      self.__tags = {}
+      self.__next()
+
+   def __next(self):
+      if not self.candidates and self.workers is not None and self.results:
+         chunk = max(self.results, key=self.results.get)[1]
+         self.candidates = [(p, chunk) for p in self.workers]
+         self.workers = None
+      if not self.candidates:
+         self.settings = max(self.results, key=self.results.get) if self.results else None
+         self.current = self.settings
+         return
+      self.current = self.candidates.pop(0)
+      self.__started = None
+      self.__tasks = 0
+      self.__jobs = 0
+
+   @property
+   def tuning(self):
+      return self.settings is None and self.current is not None
+
+   def plan(self, budget):
+      """
+         Fit the search into budget warm-up jobs. Samples per candidate are lowered first,
+         then the largest task sizes and at last the fewer worker candidates are skipped. The
+         worker candidates are costed at the largest task size, their own is not known yet.
+      """
+      self.budget = budget
+      chunks = [self.current[1]] + [chunk for p, chunk in self.candidates]
+
+      def cost(samples, chunks, workers):
+         largest = max(chunks)
+         return samples * (
+            sum(self.processes * chunk for chunk in chunks) + sum(workers) * largest
+         )
+
+      while self.samples > 1 and cost(self.samples, chunks, self.workers) > budget:
+         self.samples = self.samples - 1
+      while chunks.__len__() > 1 and cost(self.samples, chunks, self.workers) > budget:
+         largest = max(chunks)
+         chunks.remove(largest)
+         self.skipped.append((self.processes, largest))
+      if self.workers and cost(self.samples, chunks, self.workers) > budget:
+         self.skipped.extend((p, None) for p in self.workers)
+         self.workers = []
+      self.candidates = [candidate for candidate in self.candidates
+                         if candidate not in self.skipped]
+      if self.current in self.skipped:
+         self.current = self.candidates.pop(0)
+
+   def submitted(self, task_id, now):
+      if not self.tuning:
+         return
+      self.__tags[task_id] = self.current
+      if self.__started is None:
+         self.__started = now
+
+   def completed(self, task_id, jobs, now):
+      tag = self.__tags.pop(task_id, None)
+      if not self.tuning:
+         return
+      self.jobs_seen = self.jobs_seen + jobs
+      if tag == self.current:
+         self.__tasks = self.__tasks + 1
+         self.__jobs = self.__jobs + jobs
+         if self.__tasks >= self.samples * self.current[0]:
+            self.results[self.current] = self.__jobs / max(now - self.__started, 1e-6)
+            self.__next()
+      if self.tuning and self.budget is not None and self.jobs_seen >= self.budget:
+         # Out of warm-up jobs
+         self.finish()
+
+   def finish(self):
+      """
+         Settle on the best candidate timed so far.
+      """
+      if self.tuning:
+         self.skipped.append(self.current)
+      self.skipped.extend(self.candidates)
+      self.skipped.extend((p, None) for p in self.workers or ())
+      self.candidates = []
+      self.workers = None
+      self.__next()
+
+
+class _TaskBudget(int):
+   """
+      maxtasksperchild of a process pool that also runs out once the worker has been marked
+      for recycling, the pool worker loop then exits after returning its current task. This
+      relies on the loop condition of multiprocessing.pool.worker,
+         while maxtasks is None or (maxtasks and completed < maxtasks):
+      where Python calls the reflected __gt__ of an int subclass on the right first. That is
+      not a documented interface, open() checks it with _task_budget_works() before use.
+   """
+   def __gt__(self, completed):
+      return not _RECYCLE and int(self) > completed
+
+
+def _task_budget_works():
+   """
+      Whether the pool worker loop of this Python exits on a _TaskBudget run out, its source
+      must hold the loop condition and the condition must end the loop once _RECYCLE is set.
+   """
+   global _RECYCLE, _TASK_BUDGET_OK
+   if _TASK_BUDGET_OK is None:
+      import inspect
+      from multiprocessing import pool
+      try:
+         source = inspect.getsource(pool.worker)
+      except (OSError, TypeError):
+         source = ''
+      recycle = _RECYCLE
+      _RECYCLE = True
+      try:
+         budget = _TaskBudget(2)
+         completed = 0
+         _TASK_BUDGET_OK = 'completed < maxtasks' in source and not (
+            budget is None or (budget and completed < budget)
+         )
+      finally:
+         _RECYCLE = recycle
+   return _TASK_BUDGET_OK
+
+
+def create_pool(processes, initializer=None, initargs=(), backend=BACKEND, address=None,
+                authkey=None, maxtasks=None):
+   try:
+      if DEBUG:
+         print('MEDUSA: DEBUG: Creating %s pool with %s processes...' % (backend, processes))
+      global POOL
+      if backend == 'process':
+         POOL = mp.Pool(int(processes), initializer, initargs, maxtasks)
+      elif backend == 'thread':
+         from multiprocessing.pool import ThreadPool
+         POOL = ThreadPool(int(processes), initializer, initargs)
+      elif backend == 'serial':
+         POOL = SerialPool(int(processes), initializer, initargs)
+      elif backend == 'distributed':
+         POOL = DistributedPool(
+            int(processes), initializer, initargs, address or DISTRIBUTED_ADDRESS, authkey
+         )
+      else:
+         raise ValueError('Unknown BACKEND %s, expected one of %s' % (backend, BACKENDS))
+      if DEBUG:
+         print('MEDUSA: DEBUG: Creating pool...DONE')
+      return POOL
+   except Exception as e:
+      print(
+         'MEDUSA: ERROR: Exception while creating global POOL, ERR - \n' +
+         str(traceback.format_exc()) + '\n' + str(e)
+      )
+      sys.exit(1)
+
+
+def get_codec(fmt):
+   """
+      Return the (dumps, loads) pair for a binary RESULT_FORMAT.
+   """
+   if fmt == 'pickle':
+      return (functools.partial(pickle.dumps, protocol=PICKLE_PROTOCOL), pickle.loads)
+   if fmt == 'msgpack':
+      try:
+         import msgpack
+      except ImportError:
+         raise ImportError('RESULT_FORMAT msgpack requires the msgpack package.')
+      return (
+         functools.partial(msgpack.packb, use_bin_type=True),
+         functools.partial(msgpack.unpackb, raw=False)
+      )
+   raise ValueError('Unknown binary RESULT_FORMAT %s' % fmt)
+
+
+def get_compression(name, level=None):
+   """
+      Return the (writer, reader) pair of a RESULT_COMPRESSION. writer(raw) wraps a binary file
+      in a stream that writes one compressed frame, ended by its close() which leaves raw open.
+      reader(raw) streams the data of any number of concatenated frames.
+   """
+   if name == 'gzip':
+      import gzip
+      return (
+         lambda raw: gzip.GzipFile(
+            fileobj=raw, mode='wb', compresslevel=6 if level is None else level
+         ),
+         lambda raw: gzip.GzipFile(fileobj=raw, mode='rb')
+      )
+   if name == 'zstd':
+      try:
+         import zstandard
+      except ImportError:
+         raise ImportError('RESULT_COMPRESSION zstd requires the zstandard package.')
+      return (
+         lambda raw: zstandard.ZstdCompressor(level=3 if level is None else level).stream_writer(
+            raw, closefd=False
+         ),
+         # Buffered so that read(n) is never short inside a frame
+         lambda raw: io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(
+            raw, read_across_frames=True, closefd=False
+         ))
+      )
+   if name == 'lz4':
+      try:
+         import lz4.frame
+      except ImportError:
+         raise ImportError('RESULT_COMPRESSION lz4 requires the lz4 package.')
+      return (
+         lambda raw: lz4.frame.LZ4FrameFile(raw, mode='wb', compression_level=level or 0),
+         lambda raw: lz4.frame.LZ4FrameFile(raw, mode='rb')
+      )
+   raise ValueError('Unknown RESULT_COMPRESSION %s' % name)
+
+
+def read_records(path, fmt=RESULT_FORMAT, compression=None):
+   """
+      Stream the records of a results file or worker shard, one record in memory at a time,
+      decompressed on the fly. Text records are parsed with ast.literal_eval, values whose
+      str() is not a python literal are returned as the raw string.
+   """
+   with open(path, 'rb') as raw:
+      r = raw if compression is None else get_compression(compression)[1](raw)
+      for record in _read_stream(r, fmt, path):
+         yield record
+
+
+def _read_stream(r, fmt, name):
+   """
+      The records of a binary stream of RESULT_FORMAT, name is used in errors.
+   """
+   if fmt == 'text':
+      for line in io.TextIOWrapper(r):
+         record = _parse_text(line)
+         if record is not None:
+            yield record
+      return
+   loads = get_codec(fmt)[1]
+   while True:
+      header = r.read(FRAME.size)
+      if not header:
+         break
+      data = b''
+      if header.__len__() == FRAME.size:
+         size = FRAME.unpack(header)[0]
+         data = r.read(size)
+      if header.__len__() < FRAME.size or data.__len__() < size:
+         raise ValueError('Truncated record in %s' % name)
+      yield loads(data)
+
+
+def _parse_text(line):
+   """
+      The record of one line of a text results file, None for the list brackets.
+   """
+   line = line.strip()
+   if line in ('', '[', ']', ','):
+      return None
+   if line.endswith(','):
+      line = line[:-1]
+   try:
+      return ast.literal_eval(line)
+   except (ValueError, SyntaxError):
+      return line
+
+
+def read_segments(segments, fmt=RESULT_FORMAT, compression=None):
+   """
+      Stream the records of (path, start, end) byte ranges of result files or shards in order,
+      one range in memory at a time. Compressed ranges hold whole frames and are decompressed
+      as a stream.
+   """
+   loads = None if fmt == 'text' else get_codec(fmt)[1]
+   reader = None if compression is None else get_compression(compression)[1]
+   fd = None
+   opened = None
+   try:
+      for path, start, end in segments:
+         if path != opened:
+            if fd is not None:
+               os.close(fd)
+            fd = os.open(path, os.O_RDONLY)
+            opened = path
+         data = os.pread(fd, end - start, start)
+         if data.__len__() < end - start:
+            raise ValueError('Truncated range %s-%s in %s' % (start, end, path))
+         if reader is not None:
+            for record in _read_stream(
+               reader(io.BytesIO(data)), fmt, '%s %s-%s' % (path, start, end)
+            ):
+               yield record
+            continue
+         if loads is None:
+            for line in data.decode().splitlines():
+               record = _parse_text(line)
+               if record is not None:
+                  yield record
+            continue
+         offset = 0
+         while offset < data.__len__():
+            size = FRAME.unpack_from(data, offset)[0]
+            offset = offset + FRAME.size
+            yield loads(data[offset:offset + size])
+            offset = offset + size
+   finally:
+      if fd is not None:
+         os.close(fd)
+
+
+def copy_range(src, dst, count, src_offset=0, dst_offset=0):
+   """
+      Copy count bytes between two file descriptors at explicit offsets without moving either
+      file position. Uses os.copy_file_range and falls back to pread/pwrite blocks of
+      MERGE_BLOCK_SIZE, memory use is bounded either way.
+   """
+   kernel_copy = hasattr(os, 'copy_file_range')
+   while count > 0:
+      copied = 0
+      if kernel_copy:
+         try:
+            copied = os.copy_file_range(src, dst, min(count, 1 << 30), src_offset, dst_offset)
+         except OSError:
+            # Cross filesystem copies on older kernels, or unsupported file systems
+            kernel_copy = False
+      if not copied:
+         data = os.pread(src, min(count, MERGE_BLOCK_SIZE), src_offset)
+         if not data:
+            raise ValueError('Source ended %s bytes early' % count)
+         copied = os.pwrite(dst, data, dst_offset)
+      count = count - copied
+      src_offset = src_offset + copied
+      dst_offset = dst_offset + copied
+
+
+def merge_files(db, segments, header=b'', footer=b'', trim=0, threads=1):
+   """
+      Write header, the given byte ranges back to back and footer to db in a single pass.
+      segments are (path, start, end) ranges, or plain paths for whole files. Missing files
+      are skipped, trim drops that many bytes from the end of the last non empty range.
+      Returns the list of files that were found.
+   """
+   found = {}
+   parts = []
+   for segment in segments:
+      ranged = not isinstance(segment, str)
+      if not ranged:
+         segment = (segment, 0, None)
+      path, start, end = segment
+      try:
+         size = os.path.getsize(path)
+      except OSError:
+         if ranged:
+            # Output of a completed task, unlike a worker that never wrote its shard
+            print('MEDUSA: WARNING: %s is missing, %s bytes of results are lost.' % (
+               path, end - start
+            ))
+         continue
+      found[path] = True
+      end = size if end is None else min(end, size)
+      if end > start:
+         parts.append([path, start, end - start])
+   if parts and trim:
+      parts[-1][2] = max(0, parts[-1][2] - trim)
+   offsets = []
+   offset = header.__len__()
+   for path, start, size in parts:
+      offsets.append(offset)
+      offset = offset + size
+   fd = os.open(db, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+   try:
+      os.ftruncate(fd, offset + footer.__len__())
+      os.pwrite(fd, header, 0)
+
+      def copy_part(index):
+         path, start, size = parts[index]
+         src = os.open(path, os.O_RDONLY)
+         try:
+            copy_range(src, fd, size, start, offsets[index])
+         finally:
+            os.close(src)
+
+      if threads > 1 and parts.__len__() > 1:
+         import concurrent.futures
+         with concurrent.futures.ThreadPoolExecutor(max_workers=int(threads)) as executor:
+            list(executor.map(copy_part, range(parts.__len__())))
+      else:
+         for index in range(parts.__len__()):
+            copy_part(index)
+      os.pwrite(fd, footer, offset)
+   finally:
+      os.close(fd)
+   return list(found)
+
+
+class Metrics(object):
+   """
+      Run metrics aggregated in the parent from the stats reported with every task. Memory
+      is bounded by the number of workers plus METRICS_SAMPLES task latencies.
+   """
+   def __init__(self, samples=METRICS_SAMPLES, per_task=False):
+      self.samples = samples
+      self.per_task = per_task
+      self.started = time.time()
+      self.ended = None
+      self.tasks = 0
+      self.jobs = 0
+      self.latency = []
+      self.workers = {}
+      self.task_records = []
+      self.depth_max = 0
+      self.depth_sum = 0
+      self.depth_count = 0
+
+   def task(self, pid, stats, jobs):
+      """
+         Account for one completed task of jobs jobs run by worker pid.
+      """
+      self.tasks = self.tasks + 1
+      self.jobs = self.jobs + jobs
+      elapsed = stats['elapsed']
+      if self.latency.__len__() < self.samples:
+         self.latency.append(elapsed)
+      else:
+         slot = random.randrange(self.tasks)
+         if slot < self.samples:
+            self.latency[slot] = elapsed
+      worker = self.workers.get(pid)
+      if worker is None:
+         worker = {'pid': pid, 'tasks': 0, 'jobs': 0, 'busy': 0.0, 'cpu': 0.0, 'rss_max': 0}
+         self.workers[pid] = worker
+      worker['tasks'] = worker['tasks'] + 1
+      worker['jobs'] = worker['jobs'] + jobs
+      worker['busy'] = worker['busy'] + elapsed
+      worker['cpu'] = worker['cpu'] + stats.get('cpu', 0.0)
+      worker['rss_max'] = max(worker['rss_max'], stats.get('rss', 0))
+      if self.per_task:
+         self.task_records.append(
+            {'type': 'task', 'pid': pid, 'jobs': jobs, 'time': time.time(), 'stats': stats}
+         )
+
+   def queue(self, depth):
+      """
+         Sample the number of tasks submitted to the pool but not completed.
+      """
+      self.depth_max = max(self.depth_max, depth)
+      self.depth_sum = self.depth_sum + depth
+      self.depth_count = self.depth_count + 1
+
+   def percentile(self, q):
+      if not self.latency:
+         return 0.0
+      ordered = sorted(self.latency)
+      return ordered[int(round(q * (ordered.__len__() - 1)))]
+
+   def summary(self):
+      wall = (self.ended or time.time()) - self.started
+      return {
+         'type': 'run',
+         'wall': wall,
+         'tasks': self.tasks,
+         'jobs': self.jobs,
+         'tasks_per_sec': self.tasks / wall if wall > 0 else 0.0,
+         'jobs_per_sec': self.jobs / wall if wall > 0 else 0.0,
+         'latency_p50': self.percentile(0.5),
+         'latency_p99': self.percentile(0.99),
+         'latency_max': max(self.latency) if self.latency else 0.0,
+         'queue_depth_max': self.depth_max,
+         'queue_depth_mean': self.depth_sum / float(self.depth_count) if self.depth_count else 0.0,
+         'workers': self.workers.__len__(),
+      }
+
+   def worker_records(self):
+      wall = (self.ended or time.time()) - self.started
+      records = []
+      for worker in self.workers.values():
+         record = dict(worker, type='worker')
+         record['idle'] = max(0.0, wall - worker['busy'])
+         records.append(record)
+      return records
+
+   def write_jsonl(self, path, job):
+      with open(path, 'a') as w:
+         for record in [self.summary()] + self.worker_records() + self.task_records:
+            record['job'] = job
+            w.write(json.dumps(record) + '\n')
+
+   def write_prometheus(self, path, job):
+      """
+         Write a node_exporter textfile, replaced atomically.
+      """
+      summary = self.summary()
+      lines = []
+      for name in sorted(summary):
+         if name not in ('type', ):
+            lines.append('medusa_%s{job="%s"} %s' % (name, job, summary[name]))
+      for worker in self.worker_records():
+         for name in ('tasks', 'jobs', 'busy', 'idle', 'cpu', 'rss_max'):
+            lines.append('medusa_worker_%s{job="%s",pid="%s"} %s' % (
+               name, job, worker['pid'], worker[name]
+            ))
+      with open(path + '.tmp', 'w') as w:
+         w.write('\n'.join(lines) + '\n')
+      os.rename(path + '.tmp', path)
+
+
+class Journal(object):
+   """
+      Durable progress log of a run. Every completed task appends one frame holding its job
+      keys and where its output is, a shard byte range in file mode or the pickled record
+      batch in memory mode. Frames are flushed and fsynced as they are written, a torn last
+      frame left by a crash is dropped on load.
+   """
+   def __init__(self, path):
+      self.path = path
+      self.__file = None
+
+   def load(self):
+      """
+         Return the entries of an existing journal, [] when there is none.
+      """
+      entries = []
+      good = 0
+      try:
+         r = open(self.path, 'rb')
+      except OSError:
+         return entries
+      with r:
+         while True:
+            header = r.read(FRAME.size)
+            if header.__len__() < FRAME.size:
+               break
+            data = r.read(FRAME.unpack(header)[0])
+            try:
+               entries.append(pickle.loads(data))
+            except Exception:
+               break
+            good = r.tell()
+      with open(self.path, 'rb+') as w:
+         w.truncate(good)
+      return entries
+
+   def open(self, resume=False):
+      self.__file = open(self.path, 'ab' if resume else 'wb')
+
+   def record(self, keys, segment=None, batch=None, ranges=None):
+      data = pickle.dumps(
+         {'keys': keys, 'segment': segment, 'batch': batch, 'ranges': ranges},
+         protocol=PICKLE_PROTOCOL
+      )
+      self.__file.write(FRAME.pack(data.__len__()))
+      self.__file.write(data)
+      self.__file.flush()
+      os.fsync(self.__file.fileno())
+
+   def close(self):
+      if self.__file is not None:
+         self.__file.close()
+         self.__file = None
+
+   def remove(self):
+      self.close()
+      if os.path.exists(self.path):
+         os.remove(self.path)
+
+
+class Manifest(object):
+   """
+      Index of an incremental result set. jobs maps the key of every job in the set to its
+      (fingerprint, part, start, end), the output of the job being that byte range of the part
+      file. Parts are only ever appended as new files, the manifest itself is replaced
+      atomically once the parts it points to are on disk.
+   """
+   def __init__(self, path, parts):
+      self.path = path
+      self.parts = parts
+      self.namespace = None
+      self.format = None
+      self.jobs = {}
+      self.next_part = 0
+
+   def load(self, namespace, fmt):
+      """
+         Read the manifest, returns False when there is none or it was written by other code
+         or for another RESULT_FORMAT, the set then starts out empty.
+      """
+      try:
+         with open(self.path, 'rb') as r:
+            state = pickle.load(r)
+      except (OSError, EOFError, pickle.UnpicklingError):
+         state = None
+      self.next_part = state['next_part'] if state else 0
+      if state is None or state['namespace'] != namespace or state['format'] != fmt:
+         self.namespace = namespace
+         self.format = fmt
+         self.jobs = {}
+         return False
+      self.namespace = namespace
+      self.format = fmt
+      self.jobs = state['jobs']
+      return True
+
+   def save(self):
+      os.makedirs(self.parts, exist_ok=True)
+      tmp = '%s.%s.tmp' % (self.path, os.getpid())
+      with open(tmp, 'wb') as w:
+         pickle.dump({
+            'namespace': self.namespace, 'format': self.format, 'jobs': self.jobs,
+            'next_part': self.next_part
+         }, w, protocol=PICKLE_PROTOCOL)
+         w.flush()
+         os.fsync(w.fileno())
+      os.replace(tmp, self.path)
+      # Parts no longer referenced by any job are garbage
+      live = set(entry[1] for entry in self.jobs.values())
+      for name in os.listdir(self.parts):
+         if name not in live:
+            os.remove(os.path.join(self.parts, name))
+
+   def new_part(self):
+      """
+         Name of the next part file, parts are never written twice.
+      """
+      os.makedirs(self.parts, exist_ok=True)
+      name = 'part-%06d' % self.next_part
+      self.next_part = self.next_part + 1
+      return name
+
+   def part_path(self, name):
+      return os.path.join(self.parts, name)
+
+   def segments(self):
+      """
+         (path, start, end) of the output of every job in the set.
+      """
+      return [
+         (self.part_path(part), start, end) for fingerprint, part, start, end in self.jobs.values()
+      ]
+
+   def append(self, fresh, order, merge_threads=1):
+      """
+         Write the (fingerprint, shard, start, end) output of fresh jobs as one new part and
+         rebuild the set from the keys of order, retained jobs keep their part. Returns the
+         shards that were read.
+      """
+      wfiles = []
+      placed = {}
+      if fresh:
+         part = self.new_part()
+         segments = []
+         offset = 0
+         for key, (fingerprint, shard, start, end) in fresh.items():
+            segments.append((shard, start, end))
+            placed[key] = (fingerprint, part, offset, offset + end - start)
+            offset = offset + end - start
+         wfiles = merge_files(self.part_path(part), segments, threads=merge_threads)
+      jobs = {}
+      for key in order:
+         entry = placed.get(key) or self.jobs.get(key)
+         if entry is not None:
+            jobs[key] = entry
+      self.jobs = jobs
+      return wfiles
+
+   def garbage(self):
+      """
+         Fraction of the part bytes that no job in the set points to.
+      """
+      live = 0
+      for fingerprint, part, start, end in self.jobs.values():
+         live = live + end - start
+      total = 0
+      if os.path.isdir(self.parts):
+         for name in os.listdir(self.parts):
+            total = total + os.path.getsize(self.part_path(name))
+      return 1.0 - float(live) / total if total else 0.0
+
+   def compact(self, merge_threads=1):
+      """
+         Copy the output of every job into a single new part, older parts go on save().
+      """
+      part = self.new_part()
+      segments = []
+      jobs = {}
+      offset = 0
+      for key, (fingerprint, old, start, end) in self.jobs.items():
+         segments.append((self.part_path(old), start, end))
+         jobs[key] = (fingerprint, part, offset, offset + end - start)
+         offset = offset + end - start
+      merge_files(self.part_path(part), segments, threads=merge_threads)
+      self.jobs = jobs
+
+
+class StageBuffer(object):
+   """
+      Bounded buffer of record batches between two pipeline stages, iterating it yields the
+      records until the upstream stage closed it. put() waits while limit records are held,
+      with spill the batch is appended as a frame to an anonymous temp file instead, which is
+      truncated whenever the reader drained it. Spilled batches may be read out of order.
+   """
+   def __init__(self, limit=PIPELINE_BUFFER, spill=False, spool_dir=None):
+      self.limit = limit
+      self.spill = spill
+      self.spool_dir = spool_dir
+      self.count = 0
+      self.spilled = 0
+      self.__batches = collections.deque()
+      self.__spool = None
+      self.__read = 0
+      self.__write = 0
+      self.__closed = False
+      self.__aborted = False
+      self.__cond = threading.Condition()
+
+   def put(self, records):
+      records = list(records)
+      with self.__cond:
+         while not self.spill and self.count >= self.limit and not self.__aborted:
+            self.__cond.wait()
+         if self.__aborted:
+            raise RuntimeError('Pipeline stopped, another stage failed')
+         if self.count < self.limit:
+            self.__batches.append(records)
+            self.count = self.count + records.__len__()
+         else:
+            if self.__spool is None:
+               import tempfile
+               self.__spool = tempfile.TemporaryFile(prefix='medusa-pipeline.', dir=self.spool_dir)
+            data = pickle.dumps(records, protocol=PICKLE_PROTOCOL)
+            os.pwrite(self.__spool.fileno(), FRAME.pack(data.__len__()) + data, self.__write)
+            self.__write = self.__write + FRAME.size + data.__len__()
+            self.spilled = self.spilled + records.__len__()
+         self.__cond.notify_all()
+
+   def __iter__(self):
+      while True:
+         with self.__cond:
+            while not (self.__batches or self.__read < self.__write or self.__closed or
+                       self.__aborted):
+               self.__cond.wait()
+            if self.__batches:
+               batch = self.__batches.popleft()
+               self.count = self.count - batch.__len__()
+               self.__cond.notify_all()
+            elif self.__read < self.__write and not self.__aborted:
+               fd = self.__spool.fileno()
+               size = FRAME.unpack(os.pread(fd, FRAME.size, self.__read))[0]
+               batch = pickle.loads(os.pread(fd, size, self.__read + FRAME.size))
+               self.__read = self.__read + FRAME.size + size
+               if self.__read == self.__write:
+                  self.__spool.truncate(0)
+                  self.__read = self.__write = 0
+            else:
+               return
+         for record in batch:
+            yield record
+
+   def close(self):
+      """
+         No more batches, the reader stops once the buffer is drained.
+      """
+      with self.__cond:
+         self.__closed = True
+         self.__cond.notify_all()
+
+   def abort(self):
+      """
+         Stop both sides, put() raises and the reader stops at once.
+      """
+      with self.__cond:
+         self.__aborted = True
+         self.__cond.notify_all()
+      if self.__spool is not None:
+         self.__spool.close()
+
+
+class ResultBuffer(object):
+   """
+      Result records collected in the parent. Pickled batches stay in memory until their
+      total size passes limit, from then on every batch is spooled as a frame to an anonymous
+      temp file that is removed when the buffer is closed or the process exits.
+   """
+   def __init__(self, limit=RESULTS_MEMORY_LIMIT, spool_dir=None):
+      self.limit = limit
+      self.spool_dir = spool_dir
+      self.size = 0
+      self.__count = 0
+      self.__batches = []
+      self.__spool = None
+
+   def __len__(self):
+      return self.__count
+
+   def __iter__(self):
+      if self.__spool is not None:
+         self.__spool.flush()
+         fd = self.__spool.fileno()
+         offset = 0
+         while True:
+            header = os.pread(fd, FRAME.size, offset)
+            if not header:
+               break
+            size = FRAME.unpack(header)[0]
+            for record in pickle.loads(os.pread(fd, size, offset + FRAME.size)):
+               yield record
+            offset = offset + FRAME.size + size
+      for batch in self.__batches:
+         for record in pickle.loads(batch):
+            yield record
+
+   @property
+   def spooled(self):
+      return self.__spool is not None
+
+   def add(self, packed, count):
+      """
+         Add a pickled list of count records, or the list itself from an in-process or the
+         distributed backend. Lists are pickled here so that every batch counts towards limit.
+      """
+      self.__count = self.__count + count
+      if not isinstance(packed, bytes):
+         packed = pickle.dumps(packed, protocol=PICKLE_PROTOCOL)
+      self.size = self.size + packed.__len__()
+      if self.__spool is None and self.size > self.limit:
+         import tempfile
+         self.__spool = tempfile.TemporaryFile(prefix='medusa-results.', dir=self.spool_dir)
+         for batch in self.__batches:
+            self.__write(batch)
+         self.__batches = []
+      if self.__spool is None:
+         self.__batches.append(packed)
+      else:
+         self.__write(packed)
+
+   def __write(self, packed):
+      self.__spool.write(FRAME.pack(packed.__len__()))
+      self.__spool.write(packed)
+
+   def close(self):
+      self.__batches = []
+      if self.__spool is not None:
+         self.__spool.close()
+         self.__spool = None
+
+
+class RecordWriter(object):
+   """
+      Append result records to a worker shard file in one of the RESULT_FORMATS. With a
+      compression the records of one writer become one compressed frame of the shard, text
+      records then lead with their separator as the last one of a frame can not be trimmed.
+   """
+   def __init__(self, path, fmt=RESULT_FORMAT, compression=None, level=None):
+      self.path = path
+      self.format = fmt
+      self.compression = compression
+      self.__dumps = None if fmt == 'text' else get_codec(fmt)[0]
+      self.__raw = open(path, 'ab')
+      self.__file = self.__raw
+      if compression is not None:
+         self.__file = get_compression(compression, level)[0](self.__raw)
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, exc_type, exc_value, tb):
+      self.close()
+      return False
+
+   def write(self, record):
+      if self.__dumps is None:
+         if self.compression is None:
+            self.__file.write((str(record) + ',\n').encode())
+         else:
+            self.__file.write((',\n' + str(record)).encode())
+         return
+      data = self.__dumps(record)
+      self.__file.write(FRAME.pack(data.__len__()))
+      self.__file.write(data)
+
+   def close(self):
+      if self.__file is not self.__raw:
+         # Ends the compressed frame
+         self.__file.close()
+      self.__raw.close()
+
+
+class ResultCache(object):
+   """
+      Persistent content addressed cache of per job output, one pickle per entry named by its
+      key under path. Entries are written to a temp file and renamed into place, so workers
+      and concurrent runs share the cache without locking. Reads refresh the mtime of an
+      entry and evict() removes the least recently used ones past size bytes under an flock.
+   """
+   def __init__(self, path, size=CACHE_SIZE):
+      self.path = path
+      self.size = size
+      self.hits = 0
+      self.misses = 0
+      self.evicted = 0
+      os.makedirs(path, exist_ok=True)
+
+   def entry_path(self, key):
+      return os.path.join(self.path, key[:2], key)
+
+   def get(self, key):
+      """
+         The (value, ) stored under key, None on a miss.
+      """
+      path = self.entry_path(key)
+      try:
+         with open(path, 'rb') as r:
+            entry = pickle.load(r)
+         os.utime(path)
+      except (OSError, EOFError, pickle.UnpicklingError):
+         self.misses = self.misses + 1
+         return None
+      self.hits = self.hits + 1
+      return entry
+
+   def put(self, key, value):
+      path = self.entry_path(key)
+      tmp = '%s.%s-%s.tmp' % (path, os.getpid(), threading.get_ident())
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      with open(tmp, 'wb') as w:
+         pickle.dump((value, ), w, protocol=PICKLE_PROTOCOL)
+      os.replace(tmp, path)
+
+   def evict(self):
+      """
+         Remove least recently used entries until the cache fits in size bytes, returns the
+         bytes left.
+      """
+      with open(os.path.join(self.path, '.lock'), 'a') as lock:
+         fcntl.flock(lock, fcntl.LOCK_EX)
+         entries = []
+         total = 0
+         for folder in os.scandir(self.path):
+            if not folder.is_dir():
+               continue
+            for entry in os.scandir(folder.path):
+               if entry.name.endswith('.tmp'):
+                  continue
+               try:
+                  stat = entry.stat()
+               except OSError:
+                  continue
+               entries.append((stat.st_mtime, stat.st_size, entry.path))
+               total = total + stat.st_size
+         entries.sort()
+         for mtime, size, path in entries:
+            if total <= self.size:
+               break
+            try:
+               os.remove(path)
+            except OSError:
+               pass
+            total = total - size
+            self.evicted = self.evicted + 1
+      return total
+
+
+class JobSlice(object):
+   """
+      Task of the batch mode, the jobs start:stop of the job array shared under name. Only
+      the name and bounds are pickled and workers resolve them to a zero copy view with
+      Medusa.shared(). Where shared memory does not reach, data carries the slice itself.
+   """
+   def __init__(self, name, start, stop, view=None, data=None):
+      self.name = name
+      self.start = start
+      self.stop = stop
+      self.view = view
+      self.data = data
+
+   def __getstate__(self):
+      return (self.name, self.start, self.stop, self.data)
+
+   def __setstate__(self, state):
+      self.name, self.start, self.stop, self.data = state
+      self.view = None
+
+   def __len__(self):
+      return self.stop - self.start
+
+   def __iter__(self):
+      # Parent side, the jobs as Python values for journal keys and job weights
+      return iter(self.view[self.start:self.stop].tolist())
+
+   def resolve(self, instance):
+      if self.data is not None:
+         return self.data
+      return instance.shared(self.name)[self.start:self.stop]
+
+
+class TaskTimeout(Exception):
+   """
+      Raised inside a worker when a task runs past TASK_TIMEOUT.
+   """
+   pass
+
+
+class TaskCancelled(Exception):
+   """
+      Raised inside a worker when the parent cancels a speculative copy that lost.
+   """
+   pass
+
+
+def _on_task_timeout(signum, frame):
+   raise TaskTimeout('Task exceeded TASK_TIMEOUT')
+
+
+def _on_task_cancel(signum, frame):
+   # The signal may arrive after the attempt it was meant for, only cancel listed attempts
+   if _ATTEMPT is not None and _ATTEMPT in _CANCELLED[:]:
+      raise TaskCancelled('Task attempt %s was cancelled' % _ATTEMPT)
+
+
+def _worker_initializer(instance, events=None, cancelled=None, slots=None):
+   """
+      Pool initializer, runs once in every worker process.
+   """
+   global _WORKER, _EVENTS, _CANCELLED
+   _WORKER = instance
+   _EVENTS = events
+   _CANCELLED = cancelled
+   if cancelled is not None:
+      signal.signal(signal.SIGALRM, _on_task_timeout)
+      signal.signal(signal.SIGUSR1, _on_task_cancel)
+   if slots is not None:
+      _place_worker(instance.placement, slots)
+   _WORKER.worker_init()
+
+
+def _parse_cpulist(text):
+   """
+      CPU numbers of a kernel cpulist such as '0-3,8-11'.
+   """
+   cpus = []
+   for part in text.strip().split(','):
+      if not part:
+         continue
+      first, _, last = part.partition('-')
+      cpus.extend(range(int(first), int(last or first) + 1))
+   return cpus
+
+
+def _format_cpulist(cpus):
+   """
+      Kernel cpulist notation of a CPU collection, the inverse of _parse_cpulist().
+   """
+   ranges = []
+   for cpu in sorted(cpus):
+      if ranges and ranges[-1][1] == cpu - 1:
+         ranges[-1][1] = cpu
+      else:
+         ranges.append([cpu, cpu])
+   return ','.join('%s-%s' % (a, b) if b > a else str(a) for a, b in ranges)
+
+
+def numa_nodes():
+   """
+      {node: [cpu, ...]} of the CPUs this process may run on, by NUMA node. A single node 0
+      holds all of them where the kernel reports no topology.
+   """
+   allowed = set(range(os.cpu_count() or 1))
+   if hasattr(os, 'sched_getaffinity'):
+      allowed = os.sched_getaffinity(0)
+   nodes = {}
+   for path in glob.glob('/sys/devices/system/node/node[0-9]*/cpulist'):
+      try:
+         with open(path) as r:
+            cpus = sorted(set(_parse_cpulist(r.read())) & allowed)
+      except (OSError, ValueError):
+         continue
+      if cpus:
+         nodes[int(os.path.basename(os.path.dirname(path))[4:])] = cpus
+   return nodes or {0: sorted(allowed)}
+
+
+def get_placement(processes, affinity=AFFINITY, placement=PLACEMENT, nodes=None):
+   """
+      The (node, cpus) of each of processes worker slots. 'spread' takes one CPU of every
+      node in turn, 'pack' all CPUs of a node before the next. With more workers than CPUs
+      the order starts over.
+   """
+   nodes = nodes or numa_nodes()
+   if placement == 'pack':
+      order = [(node, cpu) for node in sorted(nodes) for cpu in nodes[node]]
+   else:
+      order = []
+      for row in itertools.zip_longest(*[[(n, c) for c in nodes[n]] for n in sorted(nodes)]):
+         order.extend(cell for cell in row if cell is not None)
+   slots = []
+   for index in range(int(processes)):
+      node, cpu = order[index % order.__len__()]
+      slots.append((node, tuple(nodes[node]) if affinity == 'node' else (cpu, )))
+   return slots
+
+
+def _place_worker(placement, slots):
+   """
+      Claim the first free slot of the shared slots table for this worker and pin it to the
+      CPUs of that slot. The slot of a recycled worker is free again once its process is gone.
+   """
+   global _NODE
+   index = None
+   with slots.get_lock():
+      for i in range(slots.__len__()):
+         if slots[i] and _pid_alive(slots[i]):
+            continue
+         slots[i] = os.getpid()
+         index = i
+         break
+   if index is None:
+      return
+   node, cpus = placement[index]
+   try:
+      os.sched_setaffinity(0, cpus)
+   except OSError as e:
+      print('MEDUSA: WARNING: Worker %s not pinned to %s, ERR - %s' % (os.getpid(), cpus, e))
+      return
+   _NODE = node
+
+
+def _pid_alive(pid):
+   try:
+      os.kill(pid, 0)
+   except ProcessLookupError:
+      return False
+   except OSError:
+      pass
+   return True
+
+
+def attach_shared(segment):
+   """
+      Attach a shared memory segment by name, once per process.
+   """
+   if segment not in _SHARED_SEGMENTS:
+      from multiprocessing import shared_memory
+      try:
+         # The parent owns the segment, attaching must not register it for cleanup here
+         shm = shared_memory.SharedMemory(name=segment, track=False)
+      except TypeError:
+         shm = shared_memory.SharedMemory(name=segment)
+      _SHARED_SEGMENTS[segment] = shm
+   return _SHARED_SEGMENTS[segment]
+
+
+def _event_loop(instance):
+   """
+      This worker's event loop for async workers. It is created on first use and kept for the
+      life of the worker so that sessions opened by worker_init_async() stay bound to it.
+   """
+   loop = getattr(_LOCAL, 'loop', None)
+   if loop is None:
+      import asyncio
+      loop = _LOCAL.loop = asyncio.new_event_loop()
+      asyncio.set_event_loop(loop)
+      loop.run_until_complete(instance.worker_init_async())
+   return loop
+
+
+def _username():
+   """
+      Login name for the default RESULTS_FNAME, the uid when there is none, as in containers
+      running a uid without a passwd entry.
+   """
+   try:
+      return getpass.getuser()
+   except (KeyError, OSError):
+      return str(os.getuid())
+
+
+def _file_size(path):
+   try:
+      return os.path.getsize(path)
+   except OSError:
+      return 0
 
-# Number of processes to run in parallel
-PROCESSES = 1
-WORKER_TIMEOUT = 3600   # In Seconds - 1 hour - any more means you are too course grained!
-WORKER_EXIT_ON_TIMEOUT = True
-TEMP = '/tmp'
-PYMOD_NAME = 'worker-template'
-RESULTS_FNAME = 'results-' + PYMOD_NAME + '-' + rlc.filesys().whoami()
-RESULTS_DIR = TEMP
-CONFIG_FNAME = PYMOD_NAME + '.yaml'
 
-POOL = None
+def _available_memory():
+   """
+      Bytes of memory the system can give to new work without swapping, None when unknown.
+   """
+   try:
+      with open('/proc/meminfo') as r:
+         for line in r:
+            if line.startswith('MemAvailable:'):
+               return int(line.split()[1]) * 1024
+   except (OSError, ValueError, IndexError):
+      pass
+   return None
+
+
+def _task_done(stats):
+   """
+      Count a task of this worker and mark the worker for recycling once it reached
+      WORKER_MAX_TASKS or its RSS passed WORKER_RSS_LIMIT, stats['recycle'] tells the parent why.
+   """
+   global _TASKS, _RECYCLE
+   _TASKS = _TASKS + 1
+   if _WORKER.BACKEND != 'process' or _RECYCLE:
+      return
+   if _WORKER.WORKER_MAX_TASKS and _TASKS >= int(_WORKER.WORKER_MAX_TASKS):
+      _RECYCLE = True
+      stats['recycle'] = 'tasks'
+   elif _WORKER.WORKER_RSS_LIMIT:
+      rss = stats.get('rss') or _worker_usage()[1]
+      if rss > int(_WORKER.WORKER_RSS_LIMIT):
+         _RECYCLE = True
+         stats['recycle'] = 'rss'
 
 
-def create_pool(processes):
+def _worker_usage(thread=False):
+   """
+      (cpu seconds, resident bytes) of this process, cpu seconds of the calling thread only
+      when thread is set and the platform can tell.
+   """
+   usage = resource.getrusage(resource.RUSAGE_SELF)
+   if thread and hasattr(resource, 'RUSAGE_THREAD'):
+      usage = resource.getrusage(resource.RUSAGE_THREAD)
+   rss = usage.ru_maxrss * 1024
    try:
-      if DEBUG:
-         print('MEDUSA: DEBUG: Creating pool with %s processes...' % processes)
-      global POOL
-      POOL = mp.Pool(int(processes))
-      if DEBUG:
-         print('MEDUSA: DEBUG: Creating pool...DONE')
-   except Exception as e:
-      print(
-         'MEDUSA: ERROR: Exception while creating global POOL, ERR - \n' +
-         str(traceback.format_exc()) + '\n' + str(e)
-      )
-      sys.exit(1)
+      with open('/proc/self/statm') as r:
+         rss = int(r.read().split()[1]) * resource.getpagesize()
+   except (OSError, ValueError, IndexError):
+      pass
+   return (usage.ru_utime + usage.ru_stime, rss)
+
+
+def _worker_call(job_data, attempt=None, settings=None, timeout=None, track=False, metrics=False):
+   """
+      Pool task, runs worker_custom, or worker_async in async mode, on the worker resident
+      instance after applying the per run settings to it. Returns (pid, value, segment, stats),
+      pid being worker_id(). In file mode value is what worker_custom returned and segment the
+      (shard, start, end) byte range it wrote, with INCREMENTAL value is the (start, end)
+      range of each job instead. In memory mode the records worker_custom
+      returns or yields are pickled here as one batch, value is (count, batch), so the parent
+      can account for their size without unpickling them. The in-process backends hand over
+      the list itself. In reduce mode value is the (count, partial) of worker_reduce().
+      timeout bounds the task with SIGALRM, track reports the start of the attempt to the
+      parent so that stragglers can be spotted, metrics adds the CPU time and RSS of the
+      worker to stats.
+   """
+   global _ATTEMPT
+   if settings is not None:
+      _WORKER.__dict__.update(settings)
+      live = set()
+      for desc in _WORKER.SHARED.values():
+         live.add(desc[0])
+         live.update(desc[5].values())
+      for segment in [seg for seg in _SHARED_SEGMENTS if seg not in live]:
+         try:
+            _SHARED_SEGMENTS.pop(segment).close()
+         except BufferError:
+            pass
+   pid = _WORKER.worker_id()
+   threaded = _WORKER.BACKEND == 'thread'
+   _ATTEMPT = attempt
+   if track and _EVENTS is not None:
+      _EVENTS.put(('start', attempt, pid, time.time()))
+   if timeout and _CANCELLED is not None:
+      signal.setitimer(signal.ITIMER_REAL, float(timeout))
+   try:
+      started = time.time()
+      if metrics:
+         cpu = _worker_usage(threaded)[0]
+      work = _WORKER.worker_custom
+      if isinstance(job_data, JobSlice):
+         job_data = job_data.resolve(_WORKER)
+         work = _WORKER.worker_batch
+      if _WORKER.ASYNC_WORKERS:
+         work = _WORKER.worker_async
+      reduce = _WORKER.worker_reduce
+      if _WORKER.cache_path is not None or _WORKER.incremental:
+         work = reduce = _WORKER.worker_each
+      if _WORKER.RESULTS_MODE == 'reduce':
+         value = reduce(job_data)
+         segment = None
+      elif _WORKER.RESULTS_MODE == 'memory':
+         result = work(job_data)
+         records = list(result) if result is not None else []
+         batch = records
+         if _WORKER.BACKEND == 'process':
+            batch = pickle.dumps(records, protocol=PICKLE_PROTOCOL)
+         value = (records.__len__(), batch)
+         segment = None
+      else:
+         shard = _WORKER.shard_path()
+         start = _file_size(shard)
+         value = work(job_data)
+         segment = (shard, start, _file_size(shard))
+      stats = {'elapsed': time.time() - started}
+      if metrics:
+         usage = _worker_usage(threaded)
+         stats['cpu'] = usage[0] - cpu
+         stats['rss'] = usage[1]
+      _task_done(stats)
+      return (pid, value, segment, stats)
+   finally:
+      if timeout and _CANCELLED is not None:
+         signal.setitimer(signal.ITIMER_REAL, 0)
+      _ATTEMPT = None
 
 
 class Medusa(object):
    def __init__(self):
       self.__pids = None
       self.__chunks = None
+      self.__jobs = None
+      self.__scheduler = None
       self.__pool = None
+      self.__pool_owned = False
+      self.__stalled = False
+      self.__events = None
+      self.__cancelled = None
+      self.__cancel_count = 0
+      self.speculated = 0
+      self.recycled = 0
+      self.throttled = 0
+      self.throttled_time = 0.0
+      self.__throttled_since = None
+      self.tuner = None
+      self.placement = None
+      self.__slots = None
       self.__start = None
       self.results_file = None
+      self.results = None
+      self.reduced = None
+      self.sink = None
+      self.__folded = 0
+      self.cache = None
+      self.cache_path = None
+      self.cache_namespace = None
+      self.incremental = False
+      self.__manifest = None
+      self.__fresh = {}
+      self.__order = []
+      self.SHARED = {}
+      self.__shared = {}
+      self.__shared_nodes = {}
+      self.__segments = {}
+      self.__journal = None
+      self.__weights = {}
+      self.__default_weight = 1.0
+      self.__weighted = False
+      self.__batch = False
+      self.__timings = {}
+      self.failed = []
+      self.metrics = None
       self.TEMP = TEMP
       self.PYMOD_NAME = PYMOD_NAME
-      self.RESULTS_FNAME = RESULTS_FNAME
+      self.RESULTS_FNAME = RESULTS_FNAME or 'results-' + PYMOD_NAME + '-' + _username()
       self.RESULTS_DIR = RESULTS_DIR
       self.CONFIG_FNAME = CONFIG_FNAME
       self.PROCESSES = PROCESSES
       self.WORKER_TIMEOUT = WORKER_TIMEOUT
       self.WORKER_EXIT_ON_TIMEOUT = WORKER_EXIT_ON_TIMEOUT
+      self.SCHEDULER = SCHEDULER
+      self.DISPATCH_CHUNK_MIN = DISPATCH_CHUNK_MIN
+      self.DISPATCH_CHUNK_MAX = DISPATCH_CHUNK_MAX
+      self.DISPATCH_GUIDED_FACTOR = DISPATCH_GUIDED_FACTOR
+      self.DISPATCH_PREFETCH = DISPATCH_PREFETCH
+      self.PARTITIONER = PARTITIONER
+      self.LEARN_WEIGHTS = LEARN_WEIGHTS
+      self.AUTOTUNE = AUTOTUNE
+      self.AUTOTUNE_FILE = AUTOTUNE_FILE
+      self.AUTOTUNE_WARMUP = AUTOTUNE_WARMUP
+      self.AUTOTUNE_CHUNKS = AUTOTUNE_CHUNKS
+      self.AUTOTUNE_SAMPLES = AUTOTUNE_SAMPLES
+      self.RESULT_FORMAT = RESULT_FORMAT
+      self.RESULT_COMPRESSION = RESULT_COMPRESSION
+      self.RESULT_COMPRESSION_LEVEL = RESULT_COMPRESSION_LEVEL
+      self.MERGE_THREADS = MERGE_THREADS
+      self.RESULTS_MODE = RESULTS_MODE
+      self.RESULTS_MEMORY_LIMIT = RESULTS_MEMORY_LIMIT
+      self.CACHE = CACHE
+      self.CACHE_DIR = CACHE_DIR
+      self.CACHE_SIZE = CACHE_SIZE
+      self.CACHE_VERSION = CACHE_VERSION
+      self.INCREMENTAL = INCREMENTAL
+      self.INCREMENTAL_COMPACT = INCREMENTAL_COMPACT
+      self.JOURNAL = JOURNAL
+      self.TASK_RETRIES = TASK_RETRIES
+      self.TASK_TIMEOUT = TASK_TIMEOUT
+      self.SPECULATIVE = SPECULATIVE
+      self.SPECULATIVE_FACTOR = SPECULATIVE_FACTOR
+      self.SPECULATIVE_MIN_SAMPLES = SPECULATIVE_MIN_SAMPLES
+      self.SPECULATIVE_INTERVAL = SPECULATIVE_INTERVAL
+      self.METRICS = METRICS
+      self.METRICS_FILE = METRICS_FILE
+      self.WORKER_MAX_TASKS = WORKER_MAX_TASKS
+      self.WORKER_RSS_LIMIT = WORKER_RSS_LIMIT
+      self.MEMORY_MIN_AVAILABLE = MEMORY_MIN_AVAILABLE
+      self.AFFINITY = AFFINITY
+      self.PLACEMENT = PLACEMENT
+      self.NUMA_SHARED = NUMA_SHARED
+      self.ASYNC_WORKERS = ASYNC_WORKERS
+      self.ASYNC_CONCURRENCY = ASYNC_CONCURRENCY
+      self.BACKEND = BACKEND
+      self.DISTRIBUTED_ADDRESS = DISTRIBUTED_ADDRESS
+      self.DISTRIBUTED_AUTHKEY = DISTRIBUTED_AUTHKEY
+      self.BATCH_MODE = BATCH_MODE
+
+   def __getstate__(self):
+      # Workers receive a copy of the instance, the pool handle and collected results only
+      # live in the parent
+      state = self.__dict__.copy()
+      state['results'] = None
+      state['reduced'] = None
+      state['sink'] = None
+      state['cache'] = None
+      state['metrics'] = None
+      state['tuner'] = None
+      state['_Medusa__shared'] = {}
+      state['_Medusa__shared_nodes'] = {}
+      state['_Medusa__slots'] = None
+      state['_Medusa__segments'] = {}
+      state['_Medusa__journal'] = None
+      state['_Medusa__manifest'] = None
+      state['_Medusa__fresh'] = {}
+      state['_Medusa__order'] = []
+      state['_Medusa__weights'] = {}
+      state['_Medusa__timings'] = {}
+      state['_Medusa__pool'] = None
+      state['_Medusa__events'] = None
+      state['_Medusa__cancelled'] = None
+      state['_Medusa__pool_owned'] = False
+      return state
+
+   def __enter__(self):
+      return self.open()
+
+   def __exit__(self, exc_type, exc_value, tb):
+      self.close()
+      self.unshare()
+      return False
+
+   def open(self, processes=None):
+      """
+         Start the worker pool and keep it for every following orchestrate() call until
+         close(). worker_init() runs once in each worker. Process workers hold a snapshot of
+         the instance taken here, attributes changed after open() are not seen by workers.
+         Thread and serial workers share this instance, BACKEND is fixed until close().
+      """
+      if self.__pool is not None:
+         return self
+      if processes:
+         self.PROCESSES = processes
+      # Workers report task starts on events, cancelled attempt ids are read from a ring
+      self.__events = mp.SimpleQueue()
+      self.__cancelled = mp.RawArray('q', [-1] * CANCEL_SLOTS)
+      initargs = (self, self.__events, self.__cancelled)
+      maxtasks = None
+      if self.WORKER_MAX_TASKS or self.WORKER_RSS_LIMIT:
+         maxtasks = _TaskBudget(self.WORKER_MAX_TASKS or sys.maxsize)
+         if self.BACKEND == 'process' and not _task_budget_works():
+            print(
+               'MEDUSA: WARNING: The pool worker loop of this Python can not end early, workers '
+               'are only recycled after WORKER_MAX_TASKS tasks.'
+            )
+            maxtasks = self.WORKER_MAX_TASKS or None
+      self.placement = None
+      self.__slots = None
+      if self.AFFINITY and self.BACKEND == 'process' and hasattr(os, 'sched_setaffinity'):
+         assert self.AFFINITY in AFFINITIES and self.PLACEMENT in PLACEMENTS
+         # Workers claim a slot of the table on start and pin themselves to its CPUs
+         self.placement = get_placement(self.PROCESSES, self.AFFINITY, self.PLACEMENT)
+         self.__slots = mp.Array('i', int(self.PROCESSES))
+         initargs = initargs + (self.__slots, )
+      elif self.AFFINITY:
+         print('MEDUSA: WARNING: AFFINITY needs the process backend on Linux, ignored.')
+      if self.BACKEND != 'process':
+         # Signal handlers can only be installed per process, from its main thread
+         initargs = (self, )
+         if self.TASK_TIMEOUT or self.SPECULATIVE or maxtasks:
+            print(
+               'MEDUSA: WARNING: TASK_TIMEOUT, SPECULATIVE, WORKER_MAX_TASKS and '
+               'WORKER_RSS_LIMIT need the process backend, ignored with BACKEND = %s.' % (
+                  self.BACKEND,
+               )
+            )
+         maxtasks = None
+      self.__pool = create_pool(
+         self.PROCESSES, _worker_initializer, initargs, self.BACKEND, self.DISTRIBUTED_ADDRESS,
+         self.DISTRIBUTED_AUTHKEY, maxtasks
+      )
+      self.__pool_owned = False
+      return self
+
+   def get_placed(self):
+      """
+         (pid, node, cpus) of the workers that took a placement slot, the latest worker of
+         each slot when workers were recycled.
+      """
+      if self.__slots is None:
+         return []
+      return [(pid, ) + self.placement[index] for index, pid in enumerate(self.__slots) if pid]
+
+   def close(self, terminate=False):
+      """
+         Stop the worker pool and wait for the workers to exit, with terminate without waiting
+         for the tasks they still run.
+      """
+      global POOL
+      if self.__pool is None:
+         return
+      if terminate:
+         self.__pool.terminate()
+      else:
+         self.__pool.close()
+      self.__pool.join()
+      if POOL is self.__pool:
+         POOL = None
+      self.__pool = None
+      self.__pool_owned = False
 
    def get_chunks(self, seq, num):
       """
          Split seq in chunks of size num, used to divide tasks for workers
       """
+      import rlab_common as rlc
       if DEBUG:
          print('MEDUSA: DEBUG: Getting chunks...')
       avg = len(seq) / float(num)
@@ -85,40 +2190,917 @@ class Medusa(object):
          print('MEDUSA: DEBUG: Getting chunks...DONE')
       return out
 
+   def get_weighted_jobs(self, seq):
+      """
+         (weight, index, job) for every job, heaviest first.
+      """
+      weighted = [(float(self.job_weight(job)), index, job) for index, job in enumerate(seq)]
+      weighted.sort(key=lambda w: (-w[0], w[1]))
+      return weighted
+
+   def job_weight(self, job):
+      """
+         OPTIONAL: Override me in a subclass
+         Relative cost of a job for PARTITIONER = 'lpt', such as a file size or row count. By
+         default the seconds per job learned from earlier runs, or their median when unknown.
+      """
+      return self.__weights.get(self.job_key(job), self.__default_weight)
+
+   def load_weights(self):
+      """
+         Load the per job seconds recorded by earlier runs with LEARN_WEIGHTS.
+      """
+      self.__weights = {}
+      try:
+         with open(self.get_weights_file()) as r:
+            self.__weights = json.load(r)
+      except (OSError, ValueError):
+         pass
+      self.__default_weight = 1.0
+      if self.__weights:
+         import statistics
+         self.__default_weight = statistics.median(self.__weights.values())
+
+   def save_weights(self):
+      """
+         Fold the job timings of this run into the weights file, an even moving average.
+      """
+      for key, seconds in self.__timings.items():
+         previous = self.__weights.get(key)
+         self.__weights[key] = seconds if previous is None else (previous + seconds) / 2.0
+      self.__timings = {}
+      with open(self.get_weights_file(), 'w') as w:
+         json.dump(self.__weights, w)
+
+   def get_weights_file(self):
+      return self.RESULTS_DIR + '/' + self.RESULTS_FNAME + '.weights'
+
+   def get_dispatch_size(self, remaining):
+      """
+         Guided self-scheduling, hand out large tasks while plenty of work remains and shrink
+         towards DISPATCH_CHUNK_MIN as the queue drains so that the tail stays balanced.
+      """
+      size = int(math.ceil(remaining / float(self.DISPATCH_GUIDED_FACTOR * int(self.PROCESSES))))
+      smallest = int(self.DISPATCH_CHUNK_MIN)
+      largest = int(self.DISPATCH_CHUNK_MAX)
+      if self.ASYNC_WORKERS:
+         # A worker only overlaps the jobs of its current task, keep its event loop full
+         smallest = max(smallest, int(self.ASYNC_CONCURRENCY))
+         largest = max(largest, smallest)
+      return max(smallest, min(largest, size))
+
+   def get_tasks(self, jobs, total=None):
+      """
+         Yield the task lists handed to worker_custom by the dynamic scheduler. jobs may be
+         any iterable, only one task is taken from it at a time. When the total is unknown
+         task size starts at DISPATCH_CHUNK_MIN, so the first results arrive quickly, and
+         doubles up to DISPATCH_CHUNK_MAX.
+      """
+      jobs = iter(jobs)
+      last = 0
+      size = int(self.DISPATCH_CHUNK_MIN)
+      while True:
+         if total is not None:
+            size = self.get_dispatch_size(total - last)
+         task = list(itertools.islice(jobs, size))
+         if not task:
+            break
+         yield task
+         last += task.__len__()
+         if total is None:
+            size = min(size * 2, int(self.DISPATCH_CHUNK_MAX))
+
+   def get_weighted_tasks(self, weighted):
+      """
+         Yield dynamic scheduler tasks from (weight, index, job) heaviest first, cut by
+         weight instead of count, each task holds about the remaining weight divided by
+         DISPATCH_GUIDED_FACTOR * PROCESSES, within DISPATCH_CHUNK_MIN and DISPATCH_CHUNK_MAX
+         jobs.
+      """
+      remaining = sum(w[0] for w in weighted)
+      parts = float(self.DISPATCH_GUIDED_FACTOR * int(self.PROCESSES))
+      task = []
+      load = 0.0
+      for weight, index, job in weighted:
+         task.append(job)
+         load = load + weight
+         full = task.__len__() >= int(self.DISPATCH_CHUNK_MAX)
+         balanced = load >= remaining / parts and task.__len__() >= int(self.DISPATCH_CHUNK_MIN)
+         if full or balanced:
+            yield task
+            remaining = remaining - load
+            task = []
+            load = 0.0
+      if task:
+         yield task
+
+   def get_job_array(self, job_index):
+      """
+         Contiguous array of a numeric job_index for the batch mode. Numpy arrays and
+         array.array are used as they are, lists of ints or floats become array.array.
+         Returns None when job_index is not numeric.
+      """
+      if type(job_index).__module__ == 'numpy':
+         return job_index if job_index.dtype.kind in 'biuf' else None
+      if isinstance(job_index, array.array):
+         return job_index
+      for code in ('q', 'd'):
+         try:
+            return array.array(code, job_index)
+         except (TypeError, OverflowError):
+            continue
+      return None
+
+   def get_batch_tasks(self):
+      """
+         Yield the JobSlice tasks of the batch mode, sized like get_tasks().
+      """
+      view = self.shared(BATCH_JOBS)
+      start = 0
+      while start < self.JOB_COUNT:
+         stop = min(self.JOB_COUNT, start + self.get_dispatch_size(self.JOB_COUNT - start))
+         data = None
+         if self.BACKEND == 'distributed':
+            # Shared memory does not reach other nodes, the slice travels with the task
+            data = view[start:stop]
+            data = data.copy() if hasattr(data, 'copy') else array.array(
+               data.format, data.tobytes()
+            )
+         yield JobSlice(BATCH_JOBS, start, stop, view, data)
+         start = stop
+
+   def get_task_call(self):
+      """
+         The pool task function for this run, per run settings travel with every task so that
+         a pool opened earlier still follows them.
+      """
+      settings = dict((name, getattr(self, name)) for name in WORKER_SETTINGS)
+      settings['SHARED'] = dict(self.SHARED)
+      return functools.partial(
+         _worker_call, settings=settings, timeout=self.TASK_TIMEOUT,
+         track=bool(self.SPECULATIVE), metrics=bool(self.METRICS)
+      )
+
+   def share(self, name, obj):
+      """
+         Publish a large read only object to all workers. It is copied once into a shared
+         memory segment here and workers attach to it zero copy with shared(name), instead of
+         receiving it pickled with the instance. Supports bytes like objects, array.array and
+         numpy arrays. The segment lives until unshare() or the end of a with block. With
+         NUMA_SHARED there is one segment per NUMA node and placed workers attach their own.
+      """
+      from multiprocessing import shared_memory
+      self.unshare(name)
+      if type(obj).__module__ == 'numpy':
+         import numpy
+         obj = numpy.ascontiguousarray(obj)
+         kind = ('ndarray', obj.dtype.str, obj.shape)
+      elif hasattr(obj, 'typecode'):
+         kind = ('array', obj.typecode, None)
+      else:
+         kind = ('bytes', None, None)
+      view = memoryview(obj).cast('B')
+      nbytes = view.nbytes
+      shm = shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+      shm.buf[:nbytes] = view
+      copies = {}
+      nodes = numa_nodes() if self.NUMA_SHARED and hasattr(os, 'sched_setaffinity') else {}
+      if nodes.__len__() > 1:
+         # Pages go to the node of the CPU that first touches them, copy from each node
+         allowed = os.sched_getaffinity(0)
+         try:
+            for node, cpus in sorted(nodes.items()):
+               os.sched_setaffinity(0, cpus)
+               copy = shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+               copy.buf[:nbytes] = view
+               copies[node] = copy
+         finally:
+            os.sched_setaffinity(0, allowed)
+      view.release()
+      self.__shared[name] = shm
+      self.__shared_nodes[name] = list(copies.values())
+      self.SHARED[name] = (shm.name, nbytes) + kind + (
+         dict((node, copy.name) for node, copy in copies.items()),
+      )
+      if DEBUG:
+         print('MEDUSA: DEBUG: Shared %s as %s, %s bytes' % (name, shm.name, nbytes))
+
+   def shared(self, name):
+      """
+         Read only view of an object published with share(), a memoryview (cast to the
+         typecode for array.array) or a numpy array. Works in workers and in the parent.
+      """
+      segment, nbytes, kind, code, shape, copies = self.SHARED[name]
+      if _NODE in copies:
+         shm = attach_shared(copies[_NODE])
+      else:
+         shm = self.__shared.get(name) or attach_shared(segment)
+      view = shm.buf[:nbytes].toreadonly()
+      if kind == 'array':
+         return view.cast(code)
+      if kind == 'ndarray':
+         import numpy
+         return numpy.frombuffer(view, dtype=code).reshape(shape)
+      return view
+
+   def unshare(self, name=None):
+      """
+         Release one shared object, or all of them when name is None.
+      """
+      names = list(self.__shared) if name is None else [name]
+      for n in names:
+         shm = self.__shared.pop(n, None)
+         self.SHARED.pop(n, None)
+         if shm is None:
+            continue
+         for shm in [shm] + self.__shared_nodes.pop(n, []):
+            try:
+               shm.close()
+            except BufferError:
+               # A view handed out by shared() is still alive, the mapping goes with the process
+               pass
+            shm.unlink()
+
+   def collect(self, results, tasks=None):
+      """
+         Take in the (pid, value, segment, stats) task results. Shard byte ranges are kept
+         for save(), per job with INCREMENTAL, in memory mode record batches move into
+         self.results, with a journal each task is logged against the job keys of tasks and
+         with LEARN_WEIGHTS the task time is spread over its jobs. Returns one (pid, ) per
+         result.
+      """
+      out = []
+      for index, (pid, value, segment, stats) in enumerate(results):
+         batch = None
+         if self.RESULTS_MODE == 'reduce':
+            batch = value
+            if value[0]:
+               self.fold(value[1])
+         elif self.RESULTS_MODE == 'memory':
+            batch = value
+            if self.sink is not None:
+               # Pipeline stage, the records go on to the next stage
+               self.sink(pickle.loads(value[1]) if isinstance(value[1], bytes) else value[1])
+            else:
+               self.results.add(value[1], value[0])
+         else:
+            self.add_segment(segment)
+         ranges = None
+         if self.__manifest is not None and tasks is not None:
+            ranges = []
+            for job, (start, end) in zip(tasks[index], value):
+               ranges.append((self.job_key(job), self.job_fingerprint(job), start, end))
+               self.__fresh[ranges[-1][0]] = (ranges[-1][1], segment[0], start, end)
+         if self.__journal is not None and tasks is not None:
+            keys = [self.job_key(job) for job in tasks[index]]
+            self.__journal.record(keys, segment, batch, ranges)
+         if 'recycle' in stats:
+            self.recycled = self.recycled + 1
+         if self.metrics is not None:
+            self.metrics.task(pid, stats, tasks[index].__len__() if tasks is not None else 0)
+         if self.LEARN_WEIGHTS and tasks is not None and tasks[index]:
+            per_job = stats['elapsed'] / tasks[index].__len__()
+            for job in tasks[index]:
+               self.__timings[self.job_key(job)] = per_job
+         out.append((pid, ))
+      return out
+
+   def add_segment(self, segment):
+      """
+         Record the shard byte range written by a completed task, ranges that continue the
+         previous one of the same shard are coalesced.
+      """
+      shard, start, end = segment
+      ranges = self.__segments.setdefault(shard, [])
+      if ranges and ranges[-1][1] == start:
+         ranges[-1][1] = end
+      elif end > start:
+         ranges.append([start, end])
+
+   def get_segments(self, pids):
+      """
+         Byte ranges to merge, those written by completed tasks plus the whole shard of any
+         pid without recorded ranges.
+      """
+      segments = []
+      for shard, ranges in self.__segments.items():
+         for start, end in ranges:
+            segments.append((shard, start, end))
+      for pid in pids:
+         if self.shard_path(pid) not in self.__segments:
+            segments.append(self.shard_path(pid))
+      return segments
+
+   def job_key(self, job):
+      """
+         OPTIONAL: Override me in a subclass
+         Stable identity of a job, used by the journal to skip completed jobs on resume.
+      """
+      return repr(job)
+
+   def job_fingerprint(self, job):
+      """
+         OPTIONAL: Override me in a subclass
+         Digest of the input of a job, an incremental run dispatches a known job again when it
+         changes. Defaults to a hash of the job itself, jobs that name their input, such as
+         file paths, should include its size and mtime or a checksum.
+      """
+      return hashlib.sha256(pickle.dumps(job, protocol=PICKLE_PROTOCOL)).hexdigest()
+
+   def manifest_filter(self, jobs):
+      """
+         Yield the jobs of an incremental run that are new or whose fingerprint changed, the
+         keys of all jobs are kept as the order of the result set.
+      """
+      order = self.__order
+      for job in jobs:
+         key = self.job_key(job)
+         order.append(key)
+         entry = self.__manifest.jobs.get(key)
+         if entry is None or entry[0] != self.job_fingerprint(job):
+            yield job
+
+   def dispatch(self, tasks):
+      """
+         Submit tasks to the pool on demand and yield (task, result) pairs in completion
+         order. At most PROCESSES * DISPATCH_PREFETCH tasks are in flight, a new task is only
+         submitted once a previous one completes, so there is no barrier between batches.
+         A failed task is resubmitted up to TASK_RETRIES times, then added to self.failed,
+         or raised when neither retries nor a journal are configured. With SPECULATIVE,
+         stragglers are copied onto idle workers by speculate().
+         Raises mp.TimeoutError when no task completes within WORKER_TIMEOUT.
+      """
+      done = queue.Queue()
+      call = self.get_task_call()
+      tuner = self.tuner
+      window = int(self.PROCESSES) * int(self.DISPATCH_PREFETCH)
+      poll = self.WORKER_TIMEOUT
+      if self.SPECULATIVE:
+         poll = min(self.WORKER_TIMEOUT, self.SPECULATIVE_INTERVAL)
+      tasks = iter(tasks)
+      pending = {}    # task id -> [task, retries, running attempt ids]
+      attempts = {}   # attempt id -> [task id, pid, started]
+      durations = collections.deque(maxlen=1000)
+      counter = itertools.count()
+      exhausted = False
+      progress = time.time()
+      self.speculated = 0
+      for slot in range(CANCEL_SLOTS):
+         # Attempt ids restart with every run, forget cancellations of earlier runs
+         self.__cancelled[slot] = -1
+
+      def submit(task_id):
+         attempt = next(counter)
+         attempts[attempt] = [task_id, None, None]
+         pending[task_id][2].add(attempt)
+         self.__pool.apply_async(
+            call, (pending[task_id][0], attempt),
+            callback=lambda r: done.put((attempt, True, r)),
+            error_callback=lambda e: done.put((attempt, False, e))
+         )
+
+      while True:
+         if tuner is not None:
+            window = self.tune(tuner)
+         while not exhausted and pending.__len__() < window:
+            if not self.admit(attempts.__len__()):
+               break
+            task = next(tasks, None)
+            if task is None:
+               exhausted = True
+               break
+            task_id = next(counter)
+            pending[task_id] = [task, 0, set()]
+            if tuner is not None:
+               tuner.submitted(task_id, time.time())
+            submit(task_id)
+         if pending.__len__() == 0:
+            break
+         try:
+            attempt, ok, result = done.get(timeout=poll)
+         except queue.Empty:
+            if time.time() - progress > self.WORKER_TIMEOUT:
+               raise mp.TimeoutError()
+            if self.SPECULATIVE and exhausted:
+               self.drain_events(attempts)
+               for task_id in self.speculate(pending, attempts, durations):
+                  submit(task_id)
+            continue
+         progress = time.time()
+         if self.metrics is not None:
+            self.metrics.queue(attempts.__len__())
+         self.drain_events(attempts)
+         task_id, pid, started = attempts.pop(attempt)
+         entry = pending.get(task_id)
+         if entry is None:
+            # A copy of this task already won, its output is discarded
+            continue
+         entry[2].discard(attempt)
+         if not ok:
+            if entry[2]:
+               # Another copy of the task is still running
+               continue
+            if entry[1] < int(self.TASK_RETRIES):
+               entry[1] = entry[1] + 1
+               print(
+                  'MEDUSA: WARNING: Task failed, retry %s of %s. ERR - %s' % (
+                     entry[1], self.TASK_RETRIES, result
+                  )
+               )
+               submit(task_id)
+               continue
+            if self.__journal is None and not self.TASK_RETRIES:
+               raise result
+            print(
+               'MEDUSA: ERROR: Task failed after %s attempts. ERR - %s' % (entry[1] + 1, result)
+            )
+            self.failed.append((entry[0], result))
+            del pending[task_id]
+            continue
+         if started is not None:
+            durations.append(progress - started)
+         for other in entry[2]:
+            self.cancel(other, attempts)
+         del pending[task_id]
+         if tuner is not None:
+            tuner.completed(task_id, entry[0].__len__(), progress)
+         yield (entry[0], result)
+
+   def tune(self, tuner):
+      """
+         Apply the candidate of the autotuner to the dispatch loop, returns the number of tasks
+         to keep in flight. While tuning a candidate with fewer workers than the pool holds
+         keeps only that many tasks in flight.
+      """
+      if tuner.current is None:
+         return int(self.PROCESSES) * int(self.DISPATCH_PREFETCH)
+      processes, chunk = tuner.current
+      self.DISPATCH_CHUNK_MAX = chunk
+      if tuner.tuning:
+         # Every task of a candidate is cut at its size, not shrunk by guided scheduling
+         self.DISPATCH_CHUNK_MIN = chunk
+      else:
+         self.DISPATCH_CHUNK_MIN = min(self.__chunk_min, chunk)
+      if tuner.tuning or processes < int(self.PROCESSES):
+         return processes
+      return processes * int(self.DISPATCH_PREFETCH)
+
+   def load_autotune(self):
+      """
+         Start from the settings AUTOTUNE_FILE holds for PYMOD_NAME on this machine, or set up
+         a warm-up search from os.cpu_count() workers when there are none.
+      """
+      self.tuner = None
+      entry = self.read_autotune().get(self.PYMOD_NAME)
+      if entry and entry.get('cpus') == os.cpu_count():
+         print('MEDUSA: INFO: Autotuned processes=%s, chunk=%s, %.1f jobs/s' % (
+            entry['processes'], entry['chunk'], entry['jobs_per_sec']
+         ))
+         if self.__pool is None:
+            self.PROCESSES = entry['processes']
+         self.DISPATCH_CHUNK_MAX = entry['chunk']
+         self.DISPATCH_CHUNK_MIN = min(int(self.DISPATCH_CHUNK_MIN), entry['chunk'])
+         return
+      if self.__pool is None:
+         self.PROCESSES = os.cpu_count() or 1
+      print('MEDUSA: INFO: Autotuning from %s processes.' % self.PROCESSES)
+      self.__chunk_min = int(self.DISPATCH_CHUNK_MIN)
+      self.tuner = Autotuner(int(self.PROCESSES), self.AUTOTUNE_CHUNKS, self.AUTOTUNE_SAMPLES)
+
+   def read_autotune(self):
+      import yaml
+      try:
+         with open(os.path.expanduser(self.AUTOTUNE_FILE)) as r:
+            return yaml.safe_load(r) or {}
+      except (OSError, yaml.YAMLError):
+         return {}
+
+   def save_autotune(self):
+      """
+         Store the winner of the warm-up search under PYMOD_NAME in AUTOTUNE_FILE.
+      """
+      import yaml
+      processes, chunk = self.tuner.settings
+      tuned = self.read_autotune()
+      tuned[self.PYMOD_NAME] = {
+         'processes': processes, 'chunk': chunk, 'cpus': os.cpu_count(),
+         'jobs_per_sec': round(self.tuner.results[self.tuner.settings], 1), 'time': time.time()
+      }
+      path = os.path.expanduser(self.AUTOTUNE_FILE)
+      with open(path + '.tmp', 'w') as w:
+         yaml.safe_dump(tuned, w, default_flow_style=False)
+      os.replace(path + '.tmp', path)
+      print('MEDUSA: INFO: Autotuned processes=%s, chunk=%s saved to %s' % (
+         processes, chunk, path
+      ))
+
+   def admit(self, running):
+      """
+         Admission control of dispatch(), False holds back new tasks while system available
+         memory is below MEMORY_MIN_AVAILABLE and running tasks are left to free some. Every
+         hold back and its duration are counted in throttled and throttled_time.
+      """
+      available = None
+      if self.MEMORY_MIN_AVAILABLE and running:
+         available = _available_memory()
+      if available is None or available >= int(self.MEMORY_MIN_AVAILABLE):
+         if self.__throttled_since is not None:
+            self.throttled_time = self.throttled_time + time.time() - self.__throttled_since
+            self.__throttled_since = None
+         return True
+      if self.__throttled_since is None:
+         self.__throttled_since = time.time()
+         self.throttled = self.throttled + 1
+         if VERBOSE:
+            print('MEDUSA: INFO: %s bytes of memory available, holding back tasks.' % available)
+      return False
+
+   def drain_events(self, attempts):
+      """
+         Apply the task start events reported by workers to the attempts table.
+      """
+      while not self.__events.empty():
+         kind, attempt, pid, started = self.__events.get()
+         if attempt in attempts:
+            attempts[attempt][1] = pid
+            attempts[attempt][2] = started
+
+   def speculate(self, pending, attempts, durations):
+      """
+         Return the ids of tasks to copy onto idle workers, at most one per call. A task
+         qualifies when it has a single running attempt that has run SPECULATIVE_FACTOR times
+         the median task duration.
+      """
+      if durations.__len__() < int(self.SPECULATIVE_MIN_SAMPLES):
+         return []
+      if attempts.__len__() >= int(self.PROCESSES):
+         return []
+      import statistics
+      limit = statistics.median(durations) * float(self.SPECULATIVE_FACTOR)
+      now = time.time()
+      stragglers = []
+      for attempt, (task_id, pid, started) in attempts.items():
+         if started is not None and now - started > limit and pending[task_id][2].__len__() == 1:
+            stragglers.append((started, task_id))
+      if not stragglers:
+         return []
+      task_id = min(stragglers)[1]
+      self.speculated = self.speculated + 1
+      print(
+         'MEDUSA: INFO: Speculatively copying a straggler task, running %.1fs, median %.3fs' % (
+            now - min(stragglers)[0], statistics.median(durations)
+         )
+      )
+      return [task_id]
+
+   def cancel(self, attempt, attempts):
+      """
+         Cancel a running attempt that lost to a copy of the same task. Attempts that have not
+         started yet are left to run, their results are ignored.
+      """
+      task_id, pid, started = attempts[attempt]
+      if pid is None:
+         return
+      self.__cancelled[self.__cancel_count % CANCEL_SLOTS] = attempt
+      self.__cancel_count = self.__cancel_count + 1
+      try:
+         os.kill(pid, signal.SIGUSR1)
+      except OSError:
+         pass
+
    def worker_custom(self, data_list):
       """
           MANDATORY: Override me in a subclass
       """
-      pid = os.getpid()
-      wname = self.TEMP + '/worker.%s' % pid
+      pid = self.worker_id()
+      wname = self.shard_path(pid)
       print('MEDUSA: Starting worker file %s...' % wname)
       afile = open(wname, 'a')
 
       for row in data_list:
          # Process rows
-         print(row)
+         if VERBOSE:
+            print(row)
 
       afile.close()
       return (pid, )
 
+   async def worker_custom_async(self, job):
+      """
+          MANDATORY with ASYNC_WORKERS: Override me in a subclass
+          Process one job and return its record, many jobs of a task are awaited at once.
+      """
+      raise NotImplementedError('%s does not implement worker_custom_async' % type(self).__name__)
+
+   async def worker_init_async(self):
+      """
+         OPTIONAL: Override me in a subclass
+         Runs once on each worker process's event loop before its first async job, open
+         client sessions and connection pools here.
+      """
+      pass
+
+   async def gather_async(self, job_data):
+      """
+         Await worker_custom_async for every job, at most ASYNC_CONCURRENCY at a time, and
+         return the records in job order.
+      """
+      import asyncio
+      limit = asyncio.Semaphore(max(1, int(self.ASYNC_CONCURRENCY)))
+
+      async def one(job):
+         async with limit:
+            return await self.worker_custom_async(job)
+
+      tasks = [asyncio.ensure_future(one(job)) for job in job_data]
+      try:
+         return await asyncio.gather(*tasks)
+      except BaseException:
+         for task in tasks:
+            task.cancel()
+         await asyncio.gather(*tasks, return_exceptions=True)
+         raise
+
+   def worker_async(self, job_data):
+      """
+         Async mode task body, runs the jobs of a task as coroutines on this process's event
+         loop. In memory mode the records are returned, in file mode they are written to the
+         shard with result_writer().
+      """
+      import asyncio
+      loop = _event_loop(self)
+      try:
+         records = loop.run_until_complete(self.gather_async(job_data))
+      except BaseException:
+         # A timeout or cancel signal stops the loop with the coroutines of this task pending
+         pending = asyncio.all_tasks(loop)
+         for task in pending:
+            task.cancel()
+         loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+         raise
+      if self.RESULTS_MODE == 'memory':
+         return records
+      with self.result_writer() as w:
+         for record in records:
+            w.write(record)
+      return (os.getpid(), )
+
+   def worker_id(self):
+      """
+         Identity of the calling worker, its pid, or pid-thread with the thread backend where
+         the workers share a process.
+      """
+      if self.BACKEND == 'thread':
+         return '%s-%s' % (os.getpid(), threading.get_ident())
+      return os.getpid()
+
+   def shard_path(self, pid=None):
+      """
+         Path of the temp file a worker writes its results to, pid defaults to worker_id()
+      """
+      if pid is None:
+         pid = self.worker_id()
+      return self.TEMP + '/worker.%s' % pid
+
+   def result_writer(self):
+      """
+         Open this worker's shard for appending records in RESULT_FORMAT, use it from
+         worker_custom as a context manager.
+      """
+      return RecordWriter(
+         self.shard_path(), self.RESULT_FORMAT, self.RESULT_COMPRESSION,
+         self.RESULT_COMPRESSION_LEVEL
+      )
+
+   def iter_results(self, path=None):
+      """
+         Stream the records of the saved results file, defaults to self.results_file, of
+         self.results in memory mode, the single self.reduced value in reduce mode or the
+         result set of an incremental run.
+      """
+      if path is None and self.RESULTS_MODE == 'memory':
+         return iter(self.results)
+      if path is None and self.RESULTS_MODE == 'reduce':
+         return iter([] if self.reduced is None else [self.reduced])
+      if path is None and self.__manifest is not None:
+         return read_segments(
+            self.__manifest.segments(), self.RESULT_FORMAT, self.RESULT_COMPRESSION
+         )
+      return read_records(
+         path or self.results_file, self.RESULT_FORMAT, self.RESULT_COMPRESSION
+      )
+
+   def map(self, job):
+      """
+         OPTIONAL: Override me in a subclass
+         Reduce mode, the value of one job.
+      """
+      return job
+
+   def combine(self, partial, value):
+      """
+         OPTIONAL: Override me in a subclass
+         Reduce mode, fold the value of a job into the partial aggregate of a task. Partials
+         are merged in completion order, the operation must be associative and commutative.
+      """
+      return partial + value
+
+   def reduce(self, left, right):
+      """
+         OPTIONAL: Override me in a subclass
+         Reduce mode, merge two partial aggregates, defaults to combine().
+      """
+      return self.combine(left, right)
+
+   def worker_reduce(self, job_data, cache=None):
+      """
+         Reduce mode task body, folds map(job) of every job with combine() and returns
+         (count, partial), partial is None for an empty task. Nothing is written to disk
+         except the value of each job to cache when one is given.
+      """
+      count = 0
+      partial = None
+      for job in job_data:
+         value = self.map(job)
+         if cache is not None:
+            cache.put(self.cache_key(job), value)
+         partial = value if count == 0 else self.combine(partial, value)
+         count = count + 1
+      return (count, partial)
+
+   def worker_each(self, job_data):
+      """
+         Task body of cache and incremental runs, runs worker_custom one job at a time, or
+         map() in reduce mode, so that the output of each job is known. With CACHE it is
+         written back under cache_key(). In file mode the (start, end) shard range of every
+         job is returned, otherwise what the task body would.
+      """
+      cache = None
+      if self.cache_path is not None:
+         if self.cache is None or self.cache.path != self.cache_path:
+            self.cache = ResultCache(self.cache_path)
+         cache = self.cache
+      if self.RESULTS_MODE == 'reduce':
+         return self.worker_reduce(job_data, cache)
+      if self.RESULTS_MODE == 'memory':
+         records = []
+         for job in job_data:
+            result = self.worker_custom([job])
+            result = list(result) if result is not None else []
+            if cache is not None:
+               cache.put(self.cache_key(job), result)
+            records.extend(result)
+         return records
+      shard = self.shard_path()
+      ranges = []
+      for job in job_data:
+         start = _file_size(shard)
+         self.worker_custom([job])
+         end = _file_size(shard)
+         if cache is not None:
+            cache.put(self.cache_key(job), _read_range(shard, start, end))
+         ranges.append((start, end))
+      return ranges
+
+   def cache_config(self):
+      """
+         OPTIONAL: Override me in a subclass
+         Settings besides the job that change its output, they are part of every cache key.
+      """
+      return {}
+
+   def get_cache_namespace(self):
+      """
+         Hash of what besides the job decides its output, the source of the worker hooks of
+         this class, cache_config() and the result settings. Any change starts a fresh set of
+         cache entries, the stale ones age out, and a full rerun of an incremental run.
+      """
+      import inspect
+      digest = hashlib.sha256()
+      for name in ('worker_init', 'worker_custom', 'map'):
+         func = getattr(type(self), name)
+         try:
+            source = inspect.getsource(func)
+         except (OSError, TypeError):
+            source = repr(func.__code__.co_code)
+         digest.update(source.encode())
+      digest.update(repr((
+         self.PYMOD_NAME, self.RESULTS_MODE, self.RESULT_FORMAT, self.RESULT_COMPRESSION,
+         self.CACHE_VERSION,
+         sorted(self.cache_config().items())
+      )).encode())
+      return digest.hexdigest()
+
+   def cache_key(self, job):
+      return hashlib.sha256(
+         (self.cache_namespace + '/' + self.job_key(job)).encode()
+      ).hexdigest()
+
+   def cache_shard_path(self):
+      """
+         Shard of the cached output served in file mode, named after the parent pid and this
+         instance since concurrent runs share TEMP.
+      """
+      return self.shard_path('cache-%s-%s' % (os.getpid(), id(self)))
+
+   def cache_filter(self, jobs):
+      """
+         Yield the jobs missing from the cache. The output of cached jobs is served here, as
+         records of self.results, bytes of the cache_shard_path() shard or one partial.
+      """
+      shard = None
+      partial = None
+      count = 0
+      try:
+         for job in jobs:
+            entry = self.cache.get(self.cache_key(job))
+            if entry is None:
+               yield job
+               continue
+            value = entry[0]
+            if self.RESULTS_MODE == 'reduce':
+               partial = value if count == 0 else self.combine(partial, value)
+            elif self.RESULTS_MODE == 'memory':
+               self.results.add(value, value.__len__())
+            else:
+               if shard is None:
+                  shard = open(self.cache_shard_path(), 'ab')
+               start = shard.tell()
+               shard.write(value)
+               self.add_segment((shard.name, start, start + value.__len__()))
+               if self.__manifest is not None:
+                  self.__fresh[self.job_key(job)] = (
+                     self.job_fingerprint(job), shard.name, start, start + value.__len__()
+                  )
+            count = count + 1
+      finally:
+         if shard is not None:
+            shard.close()
+         if count and self.RESULTS_MODE == 'reduce':
+            self.fold(partial)
+
+   def fold(self, partial):
+      """
+         Reduce mode, merge the partial aggregate of a task into self.reduced with reduce()
+         as it arrives, the parent holds the running value and nothing else.
+      """
+      if self.__folded == 0:
+         self.reduced = partial
+      else:
+         self.reduced = self.reduce(self.reduced, partial)
+      self.__folded = self.__folded + 1
+
+   def worker_batch(self, batch):
+      """
+         OPTIONAL: Override me in a subclass
+         Batch mode task body, batch is a zero copy, read only array of the task's jobs, a
+         numpy array when job_index was one, otherwise a typed memoryview. Process it
+         vectorised here, by default it is handed to worker_custom.
+      """
+      return self.worker_custom(batch)
+
+   def worker_init(self):
+      """
+         OPTIONAL: Override me in a subclass
+         Runs once in each worker process before its first task, load models, lookup tables
+         or database handles here instead of in every worker_custom call.
+      """
+      pass
+
    def get_config(self):
       """
-         Worker configuration is stored as json in unix user home directory.
-         Change to /etc if you want
+         Worker configuration is stored as yaml in unix user home directory, MEDUSA_CONFIG
+         names another file. Change to /etc if you want
+         MEDUSA_PROCESSES overrides the processes of the file. Without a config file the user
+         is only asked when stdin is a terminal, services, cron jobs and workers never block.
       """
-      # Get config values - 1st from home dir, 2nd from interactive stdin
-      config_file = os.path.expanduser("~/." + str(self.CONFIG_FNAME))
+      # Get config values - 1st from env, 2nd from home dir, 3rd from interactive stdin
+      config_file = os.environ.get('MEDUSA_CONFIG') or os.path.expanduser(
+         "~/." + str(self.CONFIG_FNAME)
+      )
       processes = 4
-      try:
-         config = yaml.safe_load(open(config_file))
-      except Exception:
+      config = None
+      if os.path.exists(config_file):
+         import yaml
+         try:
+            with open(config_file) as r:
+               config = yaml.safe_load(r)
+         except Exception as e:
+            print('MEDUSA: WARNING: Ignoring config file %s, ERR - %s' % (config_file, e))
+      if not isinstance(config, dict):
+         config = {}
+      if os.environ.get('MEDUSA_PROCESSES'):
+         config["processes"] = int(os.environ['MEDUSA_PROCESSES'])
+      elif "processes" not in config and sys.stdin is not None and sys.stdin.isatty():
          newprocesses = input('MEDUSA: Number of processes [%s]: ' % processes)
          if newprocesses:
             processes = newprocesses
-         config = {}
          config["processes"] = processes
+         import yaml
          with open(config_file, 'w') as w:
             yaml.dump(config, w, default_flow_style=False, allow_unicode=True)
+      else:
+         config.setdefault("processes", processes)
 
       # Print out config values
       for c in sorted(config):
@@ -129,28 +3111,50 @@ class Medusa(object):
 
    def save_json(self, pids):
       try:
-         # Concatenate output from each worker
-         db = self.RESULTS_DIR + '/' + self.RESULTS_FNAME + '.json'
-         with open(db, 'w') as w:
-            w.write('[\n')
-            for pid in pids:
-               wfile = self.TEMP + '/worker.%s' % pid
-               try:
-                  with open(wfile) as r:
-                     w.write(r.read())
-                  os.remove(wfile)
-                  print('MEDUSA: INFO: deleted: %s' % wfile)
-               except Exception:
-                  continue
+         # Concatenate output from each worker, each record ends with ',\n' so the last two
+         # bytes of the final shard are trimmed to close the json list
+         db = self.results_file
+         if self.RESULT_COMPRESSION is None:
+            self.merge_shards(db, pids, header=b'[\n', footer=b'\n]\n', trim=2)
+         else:
+            # Compressed records lead with ',\n', the first frame with records is recompressed
+            # without it after the '[', every other frame is copied as it is
+            segments = self.get_segments(pids)
+            first = b''
+            while segments and not first:
+               segment = segments.pop(0)
+               if isinstance(segment, str):
+                  segment = (segment, 0, _file_size(segment))
+               path, start, end = segment
+               if end > start and _file_size(path) >= end:
+                  reader = get_compression(self.RESULT_COMPRESSION)[1]
+                  first = reader(io.BytesIO(_read_range(path, start, end))).read()
+            self.merge_shards(
+               db, pids, header=self.compress_frame(b'[\n' + first[2:]),
+               footer=self.compress_frame(b'\n]\n'), segments=segments
+            )
+
+      except Exception as e:
+         print(
+            'MEDUSA: ERROR: Exception while joining and saving all worker outputs, ERR - \n' +
+            str(traceback.format_exc()) + '\n' + str(e)
+         )
+         sys.exit(1)
 
-         # Remove tailing comma, remove last 2 characters (',\n')
-         with open(db, 'rb+') as w:
-            w.seek(-2, os.SEEK_END)
-            w.truncate()
+   def compress_frame(self, data):
+      """
+         data as one frame of RESULT_COMPRESSION.
+      """
+      buffer = io.BytesIO()
+      w = get_compression(self.RESULT_COMPRESSION, self.RESULT_COMPRESSION_LEVEL)[0](buffer)
+      w.write(data)
+      w.close()
+      return buffer.getvalue()
 
-         # Complete json list
-         with open(db, 'a') as a:
-            a.write('\n]\n')
+   def save_records(self, pids):
+      try:
+         # Binary records are self delimiting, the result file is the worker shards back to back
+         self.merge_shards(self.results_file, pids)
 
       except Exception as e:
          print(
@@ -159,6 +3163,41 @@ class Medusa(object):
          )
          sys.exit(1)
 
+   def save_incremental(self):
+      """
+         Append the output of the jobs run now to the incremental result set as a new part and
+         replace the manifest, compacting the parts when too much of them is garbage.
+      """
+      manifest = self.__manifest
+      print('MEDUSA: INFO: Saving %s new results to %s...' % (
+         self.__fresh.__len__(), manifest.parts
+      ))
+      wfiles = manifest.append(self.__fresh, self.__order, self.MERGE_THREADS)
+      if manifest.garbage() > self.INCREMENTAL_COMPACT:
+         print('MEDUSA: INFO: Compacting %s...' % manifest.parts)
+         manifest.compact(self.MERGE_THREADS)
+      manifest.save()
+      for wfile in wfiles:
+         os.remove(wfile)
+         print('MEDUSA: INFO: deleted: %s' % wfile)
+      self.__fresh = {}
+      self.__order = []
+      print('MEDUSA: INFO: Saving results...DONE, %s jobs in the result set.' % (
+         manifest.jobs.__len__()
+      ))
+
+   def merge_shards(self, db, pids, header=b'', footer=b'', trim=0, segments=None):
+      """
+         Merge the output of completed tasks, or the given segments of it, into db with
+         merge_files() and delete the shards.
+      """
+      if segments is None:
+         segments = self.get_segments(pids)
+      wfiles = merge_files(db, segments, header, footer, trim, self.MERGE_THREADS)
+      for wfile in wfiles:
+         os.remove(wfile)
+         print('MEDUSA: INFO: deleted: %s' % wfile)
+
    def configure(self, processes):
       print('MEDUSA: /******** ' + self.PYMOD_NAME + ' - Multi Process Worker Model ********/')
 
@@ -166,116 +3205,354 @@ class Medusa(object):
       config = self.get_config()
       self.ENV_CONFIG = config
       self.PROCESSES = config["processes"]
-      processes = self.PROCESSES
       # Overwrite config with parameter if specified
       if processes:
          self.PROCESSES = processes
          print('MEDUSA: Overridden:\nprocesses       = %s' % processes)
+      if self.AUTOTUNE:
+         self.load_autotune()
 
       assert self.PROCESSES
+      assert self.SCHEDULER in SCHEDULERS
+      assert self.RESULT_FORMAT in RESULT_FORMATS
+      assert self.RESULT_COMPRESSION in RESULT_COMPRESSIONS
+      assert self.RESULTS_MODE in RESULTS_MODES
+      assert self.PARTITIONER in PARTITIONERS
+      assert self.METRICS in METRICS_FORMATS
+      if self.RESULT_FORMAT != 'text':
+         get_codec(self.RESULT_FORMAT)
+      if self.RESULT_COMPRESSION is not None:
+         get_compression(self.RESULT_COMPRESSION)
 
+      import logging
       logging.basicConfig(
          level=logging.WARNING,
          format="%(asctime)s:%(levelname)s: %(message)s"
       )
 
-   def prepare(self, job_index=[]):
+   def prepare(self, job_index=[], resume=False):
       print('MEDUSA: Preparing ' + self.PYMOD_NAME + '...')
       self.__start = time.time()
 
       # Prepare
-      self.results_file = self.RESULTS_DIR + '/' + self.RESULTS_FNAME + '.json'
+      self.results_file = (
+         self.RESULTS_DIR + '/' + self.RESULTS_FNAME + RESULT_EXTENSIONS[self.RESULT_FORMAT] +
+         COMPRESSION_EXTENSIONS.get(self.RESULT_COMPRESSION, '')
+      )
+      if self.results is not None:
+         self.results.close()
+      self.results = None
+      if self.RESULTS_MODE == 'memory':
+         self.results = ResultBuffer(self.RESULTS_MEMORY_LIMIT, self.TEMP)
+      self.reduced = None
+      self.__folded = 0
       names = job_index
-      self.JOB_COUNT = names.__len__()
-      create_pool(self.PROCESSES)
-      self.__chunks = list(self.get_chunks(names, self.PROCESSES))
+      self.__scheduler = self.SCHEDULER
+      self.__segments = {}
+      self.failed = []
+      self.recycled = 0
+      self.throttled = 0
+      self.throttled_time = 0.0
+      self.__throttled_since = None
+      self.metrics = Metrics(per_task=VERBOSE) if self.METRICS else None
+      self.__journal = None
+      self.__manifest = None
+      self.__fresh = {}
+      self.__order = []
+      self.incremental = False
+      unsupported = self.RESULTS_MODE != 'file' or self.BATCH_MODE or self.ASYNC_WORKERS
+      if self.INCREMENTAL and unsupported:
+         print(
+            'MEDUSA: WARNING: INCREMENTAL needs RESULTS_MODE file without BATCH_MODE or '
+            'ASYNC_WORKERS, running in full.'
+         )
+      elif self.INCREMENTAL:
+         self.__manifest = Manifest(
+            self.RESULTS_DIR + '/' + self.RESULTS_FNAME + '.manifest',
+            self.RESULTS_DIR + '/' + self.RESULTS_FNAME + '.parts'
+         )
+         if not self.__manifest.load(self.get_cache_namespace(), self.RESULT_FORMAT):
+            print('MEDUSA: INFO: No manifest for this code and format, running in full.')
+         self.incremental = True
+      if self.JOURNAL or resume:
+         self.__journal = Journal(self.RESULTS_DIR + '/' + self.RESULTS_FNAME + '.journal')
+         completed = self.restore(self.__journal.load()) if resume else set()
+         self.__journal.open(resume)
+         self.__scheduler = 'dynamic'
+         if completed:
+            print('MEDUSA: INFO: Resuming, %s jobs already completed.' % completed.__len__())
+            if hasattr(names, '__len__'):
+               names = [job for job in names if self.job_key(job) not in completed]
+            else:
+               names = (job for job in names if self.job_key(job) not in completed)
+      if self.__manifest is not None:
+         if hasattr(names, '__len__'):
+            names = list(self.manifest_filter(names))
+            print('MEDUSA: INFO: Incremental run, %s of %s jobs are new or changed.' % (
+               names.__len__(), self.__order.__len__()
+            ))
+            if not names:
+               self.__scheduler = 'dynamic'
+         else:
+            names = self.manifest_filter(names)
+      self.cache = None
+      self.cache_path = None
+      self.cache_namespace = None
+      if self.CACHE and (self.BATCH_MODE or self.ASYNC_WORKERS):
+         print('MEDUSA: WARNING: CACHE is not used with BATCH_MODE or ASYNC_WORKERS.')
+      elif self.CACHE:
+         self.cache_path = self.CACHE_DIR or (
+            self.RESULTS_DIR + '/' + self.RESULTS_FNAME + '.cache'
+         )
+         self.cache = ResultCache(self.cache_path, self.CACHE_SIZE)
+         self.cache_namespace = self.get_cache_namespace()
+         if hasattr(names, '__len__'):
+            names = list(self.cache_filter(names))
+            print('MEDUSA: INFO: Cache served %s jobs.' % self.cache.hits)
+            if not names:
+               # Nothing left to split up front
+               self.__scheduler = 'dynamic'
+         else:
+            names = self.cache_filter(names)
+      if self.tuner is not None:
+         # The warm-up search needs tasks cut on demand
+         self.__scheduler = 'dynamic'
+      retried = [
+         name for name in ('TASK_RETRIES', 'TASK_TIMEOUT', 'SPECULATIVE') if getattr(self, name)
+      ]
+      if retried and self.__scheduler == 'static':
+         # The static scheduler maps whole rounds, only the dynamic one can resubmit, time out
+         # or copy a single task
+         print('MEDUSA: INFO: %s set, using the dynamic scheduler.' % ', '.join(retried))
+         self.__scheduler = 'dynamic'
+      if self.PARTITIONER == 'lpt' and self.__scheduler == 'static':
+         # Static rounds spread one chunk over every worker, weight balanced chunks would
+         # not balance the workers
+         print('MEDUSA: INFO: PARTITIONER lpt cuts weighted tasks, using the dynamic scheduler.')
+         self.__scheduler = 'dynamic'
+      if hasattr(names, '__len__'):
+         self.JOB_COUNT = names.__len__()
+      else:
+         # Generators, file handles and cursors are streamed, never held in memory
+         self.JOB_COUNT = None
+         self.__scheduler = 'dynamic'
+         print('MEDUSA: INFO: job_index has no length, streaming it with the dynamic scheduler.')
+      if self.tuner is not None and self.JOB_COUNT is not None:
+         self.tuner.plan(self.JOB_COUNT * float(self.AUTOTUNE_WARMUP))
+      self.__batch = False
+      if self.BATCH_MODE and self.JOB_COUNT is not None:
+         jobs = self.get_job_array(names)
+         if jobs is None:
+            print('MEDUSA: WARNING: job_index is not numeric, BATCH_MODE is ignored.')
+         else:
+            self.share(BATCH_JOBS, jobs)
+            self.__batch = True
+            self.__scheduler = 'dynamic'
+      if self.__pool is not None:
+         print('MEDUSA: INFO: Reusing open worker pool.')
+      self.__weights = {}
+      self.__default_weight = 1.0
+      if self.LEARN_WEIGHTS:
+         self.load_weights()
+      weighted = self.PARTITIONER == 'lpt' and self.JOB_COUNT is not None and not self.__batch
+      if self.__batch:
+         # The jobs are in shared memory, run_dynamic() cuts JobSlice tasks from them
+         self.__jobs = None
+         self.__chunks = None
+      elif self.__scheduler == 'dynamic':
+         # Tasks are cut on demand in run(), no up front split or shuffle is needed
+         self.__jobs = self.get_weighted_jobs(names) if weighted else names
+         self.__chunks = None
+      else:
+         self.__jobs = None
+         self.__chunks = list(self.get_chunks(names, self.PROCESSES))
+      self.__weighted = weighted
       print('MEDUSA: Preparing ' + self.PYMOD_NAME + '...DONE')
 
-   def run(self):
-      # Run in parallel
-      # (pids)
-      results = None
-      try:
-         print('MEDUSA: INFO: Running in parallel with %s process...' % self.PROCESSES)
-         # Batch chunks of self.PROCESSES, so that Pool doesnt error at the end.
-         if self.__chunks.__len__() == 0:
-            print('MEDUSA: ERROR: CPU chunks could not be generated per CPU core.')
-            sys.exit(1)
-         size = self.__chunks[0].__len__()
-         if size >= 100:
-            batch_size = 100
-         else:
-            batch_size = None
-         batch = self.__chunks
-         results = []
-         if batch_size:
-            print('MEDUSA: INFO: Batch size is larger than 100. Performing chunking. OK.')
-            # LARGE JOBS > 100 per core: 100 jobs per CPU core then store results, repeat
-            cpu_batch_size = float(size) / float(batch_size)
-            cpu_batch = []
-            all_cpus = []
-            for cpu_chunk in self.__chunks:
-               job_batch = []
-               for job in cpu_chunk:
-                  if job_batch.__len__() > cpu_batch_size:
-                     cpu_batch.append(job_batch)
-                     job_batch = []
-                  job_batch.append(job)
-               if job_batch.__len__() > 0:
+   def restore(self, entries):
+      """
+         Reload the output of the tasks logged in a journal and return their job keys. Tasks
+         whose shard range is gone, TEMP was cleaned up since, are left to run again.
+      """
+      completed = set()
+      lost = 0
+      for entry in entries:
+         if entry['batch'] is None and entry['segment'] is not None:
+            shard, start, end = entry['segment']
+            if _file_size(shard) < end:
+               lost = lost + entry['keys'].__len__()
+               continue
+         completed.update(entry['keys'])
+         if entry['batch'] is not None and self.RESULTS_MODE == 'reduce':
+            if entry['batch'][0]:
+               self.fold(entry['batch'][1])
+         elif entry['batch'] is not None:
+            if self.results is None:
+               print('MEDUSA: WARNING: Journal holds in memory results, set RESULTS_MODE.')
+               continue
+            self.results.add(entry['batch'][1], entry['batch'][0])
+         elif entry['segment'] is not None:
+            self.add_segment(entry['segment'])
+         for key, fingerprint, start, end in entry.get('ranges') or ():
+            self.__fresh[key] = (fingerprint, entry['segment'][0], start, end)
+      if lost:
+         print('MEDUSA: WARNING: Output of %s journaled jobs is gone from %s, rerunning them.' % (
+            lost, self.TEMP
+         ))
+      return completed
+
+   def run_static(self, results):
+      """
+         Run the PROCESSES chunks built by prepare(), large chunks are split into sub batches
+         that are mapped one CPU chunk at a time.
+      """
+      # Batch chunks of self.PROCESSES, so that Pool doesnt error at the end.
+      if self.__chunks.__len__() == 0:
+         print('MEDUSA: ERROR: CPU chunks could not be generated per CPU core.')
+         sys.exit(1)
+      size = self.__chunks[0].__len__()
+      if size >= 100:
+         batch_size = 100
+      else:
+         batch_size = None
+      batch = self.__chunks
+      if batch_size:
+         print('MEDUSA: INFO: Batch size is larger than 100. Performing chunking. OK.')
+         # LARGE JOBS > 100 per core: 100 jobs per CPU core then store results, repeat
+         cpu_batch_size = float(size) / float(batch_size)
+         cpu_batch = []
+         all_cpus = []
+         for cpu_chunk in self.__chunks:
+            job_batch = []
+            for job in cpu_chunk:
+               if job_batch.__len__() > cpu_batch_size:
                   cpu_batch.append(job_batch)
-               all_cpus.append(cpu_batch)
-               cpu_batch = []
-            print(
-               'MEDUSA: INFO: ' +
-               'TotalJobCount~=%s, CPUBatches=%s, BatchSize=%s, ExitOnWorkerTimeout=%s' % (
-                  self.JOB_COUNT, all_cpus[0].__len__(), batch_size, self.WORKER_EXIT_ON_TIMEOUT
-               )
+                  job_batch = []
+               job_batch.append(job)
+            if job_batch.__len__() > 0:
+               cpu_batch.append(job_batch)
+            all_cpus.append(cpu_batch)
+            cpu_batch = []
+         print(
+            'MEDUSA: INFO: ' +
+            'TotalJobCount~=%s, CPUBatches=%s, BatchSize=%s, ExitOnWorkerTimeout=%s' % (
+               self.JOB_COUNT, all_cpus[0].__len__(), batch_size, self.WORKER_EXIT_ON_TIMEOUT
             )
+         )
+         if DEBUG:
+            print('MEDUSA: DEBUG: all_cpus=%s' % all_cpus)
+            print('MEDUSA: DEBUG: __chunks=%s' % self.__chunks)
+         bad_batch_count = 0
+         for cpu_batch in all_cpus:
+            result = []
+            batch = cpu_batch
             if DEBUG:
-               print('MEDUSA: DEBUG: all_cpus=%s' % all_cpus)
-               print('MEDUSA: DEBUG: __chunks=%s' % self.__chunks)
-            bad_batch_count = 0
-            for cpu_batch in all_cpus:
-               result = []
-               batch = cpu_batch
-               if DEBUG:
-                  print('DEBUG: batch=%s' % batch)
-               result = POOL.map_async(
-                  self.worker_custom, batch
-               ).get(timeout=self.WORKER_TIMEOUT)
-               if not result:
-                  print('MEDUSA: WARNING: This batch was empty. No results will be recorded.')
-                  bad_batch_count = bad_batch_count + 1
-               elif type(result) == list:
-                  results.extend(result)
-               else:
-                  print('MEDUSA: ERROR: Fatal logical error in multi worker execution.')
-                  sys.exit(1)
+               print('DEBUG: batch=%s' % batch)
+            if self.metrics is not None:
+               self.metrics.queue(batch.__len__())
+            result = self.collect(self.__pool.map_async(
+               self.get_task_call(), batch
+            ).get(timeout=self.WORKER_TIMEOUT), batch)
+            if not result:
+               print('MEDUSA: WARNING: This batch was empty. No results will be recorded.')
+               bad_batch_count = bad_batch_count + 1
+            elif type(result) == list:
+               results.extend(result)
+            else:
+               print('MEDUSA: ERROR: Fatal logical error in multi worker execution.')
+               sys.exit(1)
+            if VERBOSE:
                print(
                   'MEDUSA: INFO: Batched Worker Results - count=%s, last 10 = %s' % (
                      results.__len__(), results[-10:]
                   )
                )
-               if bad_batch_count > 1:
-                  print(
-                     'MEDUSA: ERROR: More than one batches have failed resulting in result loss. ' +
-                     'Fatal error.'
-                  )
-                  sys.exit(1)
+            if bad_batch_count > 1:
+               print(
+                  'MEDUSA: ERROR: More than one batches have failed resulting in result loss. ' +
+                  'Fatal error.'
+               )
+               sys.exit(1)
+      else:
+         # SMALL JOBS < 100 per core
+         print(
+            'MEDUSA: INFO: Batch size is less than 100. Single POOL execution for all' +
+            ' workers. OK.'
+         )
+         if self.metrics is not None:
+            self.metrics.queue(batch.__len__())
+         results.extend(self.collect(self.__pool.map_async(
+            self.get_task_call(), batch
+         ).get(timeout=self.WORKER_TIMEOUT), batch))
+         if not results:
+            print('MEDUSA: ERROR: Pool.map_async() returned none. Exiting.')
+            sys.exit(1)
+
+   def run_dynamic(self, results):
+      """
+         Run job_index through dispatch(), tasks are cut by get_tasks() on demand. Only the
+         first result of each worker is kept, which is all save() needs, so parent memory
+         does not grow with the number of tasks.
+      """
+      print(
+         'MEDUSA: INFO: Dynamic scheduling. TotalJobCount=%s, ChunkMin=%s, ChunkMax=%s' % (
+            self.JOB_COUNT, self.DISPATCH_CHUNK_MIN, self.DISPATCH_CHUNK_MAX
+         )
+      )
+      pids = set()
+      count = 0
+      if self.__batch:
+         tasks = self.get_batch_tasks()
+      elif self.__weighted:
+         tasks = self.get_weighted_tasks(self.__jobs)
+      else:
+         tasks = self.get_tasks(self.__jobs, self.JOB_COUNT)
+      for task, result in self.dispatch(tasks):
+         result = self.collect([result], [task])[0]
+         count = count + 1
+         if result[0] not in pids:
+            pids.add(result[0])
+            results.append(result)
+      if DEBUG:
+         print('MEDUSA: DEBUG: Dynamic scheduling completed %s tasks.' % count)
+      if self.failed:
+         print(
+            'MEDUSA: ERROR: %s tasks failed. Completed work is kept in the journal %s' % (
+               self.failed.__len__(), self.__journal.path if self.__journal else None
+            )
+         )
+         sys.exit(1)
+
+   def run(self):
+      # Run in parallel
+      # (pids)
+      results = None
+      if self.__pool is None:
+         # No pool from open(), use one for this orchestration only and close it in clean().
+         # Opened after run_pre() so that process workers copy what it set up
+         self.open()
+         self.__pool_owned = True
+      self.__stalled = False
+      # Thread workers share the parent's pid, the shard named after it is nobody's
+      orphan = self.shard_path(os.getpid())
+      orphan_size = _file_size(orphan)
+      try:
+         print('MEDUSA: INFO: Running in parallel with %s process...' % self.PROCESSES)
+         results = []
+         if self.__scheduler == 'dynamic':
+            self.run_dynamic(results)
          else:
-            # SMALL JOBS < 100 per core
+            self.run_static(results)
+         if self.BACKEND == 'thread' and _file_size(orphan) > orphan_size:
             print(
-               'MEDUSA: INFO: Batch size is less than 100. Single POOL execution for all' +
-               ' workers. OK.'
+               'MEDUSA: ERROR: Thread workers wrote to %s, which is not merged. Write results '
+               'with shard_path() or result_writer(), every thread has its own shard.' % orphan
             )
-            results = POOL.map_async(
-               self.worker_custom, batch
-            ).get(timeout=self.WORKER_TIMEOUT)
-            if not results:
-               print('MEDUSA: ERROR: Pool.map_async() returned none. Exiting.')
-               sys.exit(1)
+            if self.__pool_owned:
+               self.close()
+            sys.exit(1)
          if results.__len__() > 0:
-            self.__pids = [r[0] for r in results]
+            self.__pids = list(dict.fromkeys(r[0] for r in results))
          else:
             print('MEDUSA: WARNING: No results created.')
             self.__pids = []
@@ -288,11 +3565,15 @@ class Medusa(object):
             )
          )
          if results:
-            self.__pids = [r[0] for r in results]
+            self.__pids = list(dict.fromkeys(r[0] for r in results))
          else:
             print('MEDUSA: WARNING: No results created.')
             self.__pids = []
+         # Tasks may still hang, clean() must not wait for them
+         self.__stalled = True
          if self.WORKER_EXIT_ON_TIMEOUT:
+            if self.__pool_owned:
+               self.close(terminate=True)
             sys.exit(1)
 
       except Exception as e:
@@ -302,29 +3583,119 @@ class Medusa(object):
             'MEDUSA: ERROR: Exception while running in parallel, ERR - \n' +
             str(traceback.format_exc()) + '\n' + str(e)
          )
+         if self.__pool_owned:
+            self.close(terminate=True)
          sys.exit(1)
 
    def save(self):
-      # Store full list of results in json format for later analysis
-      print('MEDUSA: INFO: Saving json result...')
-      self.save_json(self.__pids)
-      print('MEDUSA: INFO: Saving json result...DONE')
+      if self.RESULTS_MODE == 'reduce':
+         print('MEDUSA: INFO: Reduced %s partial aggregates.' % self.__folded)
+         return
+      if self.RESULTS_MODE == 'memory':
+         print(
+            'MEDUSA: INFO: %s results held in self.results, %s bytes, spooled=%s' % (
+               self.results.__len__(), self.results.size, self.results.spooled
+            )
+         )
+         return
+      if self.__manifest is not None:
+         self.save_incremental()
+         return
+      # Store full list of results in RESULT_FORMAT for later analysis
+      print('MEDUSA: INFO: Saving %s result...' % self.RESULT_FORMAT)
+      if self.RESULT_FORMAT == 'text':
+         self.save_json(self.__pids)
+      else:
+         self.save_records(self.__pids)
+      print('MEDUSA: INFO: Saving %s result...DONE' % self.RESULT_FORMAT)
 
    def clean(self):
+      import logging
+      import rlab_common as rlc
       # Cleanup
-      for f in glob.glob(self.TEMP + '/worker*'):
-         for pid in self.__pids:
-            if str(pid) in f:
-               os.remove(f)
+      for pid in self.__pids:
+         # Exact shard names, the pools of other pipeline stages share TEMP
+         if os.path.exists(self.shard_path(pid)):
+            os.remove(self.shard_path(pid))
+      if os.path.exists(self.cache_shard_path()):
+         os.remove(self.cache_shard_path())
       logging.warning('MEDUSA: INFO: Temp folder files deleted. Folder: %s' % self.TEMP)
+      if self.__pool_owned:
+         self.close(terminate=self.__stalled)
+      if self.LEARN_WEIGHTS:
+         self.save_weights()
+      if self.__batch:
+         self.unshare(BATCH_JOBS)
+      if self.cache is not None:
+         self.cache.evict()
+      if self.__journal is not None:
+         # The results are saved, the run no longer needs to be resumable
+         self.__journal.remove()
+         self.__journal = None
 
       # Print summary
       print('MEDUSA: INFO: Summary:')
       self.__end = time.time() - self.__start
       duration = rlc.seconds_human(self.__end)
       print('MEDUSA: INFO: Time: %s' % duration)
+      if self.cache is not None:
+         print('MEDUSA: INFO: Cache - Hits=%s, Misses=%s, Evicted=%s' % (
+            self.cache.hits, self.cache.misses, self.cache.evicted
+         ))
+      if self.tuner is not None:
+         if self.tuner.tuning:
+            self.tuner.finish()
+         print('MEDUSA: INFO: Autotune - Timed=%s, Skipped=%s' % (
+            ', '.join('%s/%s %.1f jobs/s' % (p, c, rate)
+                      for (p, c), rate in sorted(self.tuner.results.items())) or 'none',
+            ', '.join('%s/%s' % (p, c or '-') for p, c in self.tuner.skipped) or 'none'
+         ))
+         if self.tuner.settings is not None:
+            self.save_autotune()
+         else:
+            print('MEDUSA: WARNING: Too few jobs to autotune.')
+      if self.placement is not None:
+         placed = ', '.join(
+            'pid %s node%s cpus %s' % (pid, node, _format_cpulist(cpus))
+            for pid, node, cpus in self.get_placed()
+         )
+         print('MEDUSA: INFO: Placement - %s %s, %s' % (self.AFFINITY, self.PLACEMENT, placed))
+      if self.WORKER_MAX_TASKS or self.WORKER_RSS_LIMIT or self.MEMORY_MIN_AVAILABLE:
+         if self.__throttled_since is not None:
+            self.throttled_time = self.throttled_time + time.time() - self.__throttled_since
+            self.__throttled_since = None
+         print('MEDUSA: INFO: Memory - Recycled=%s, Throttled=%s, ThrottledTime=%.2fs' % (
+            self.recycled, self.throttled, self.throttled_time
+         ))
+      if self.metrics is not None:
+         self.save_metrics()
       logging.info('MEDUSA: INFO: ' + self.PYMOD_NAME + 'completed.')
 
+   def save_metrics(self):
+      """
+         Print the metrics summary and write it to METRICS_FILE.
+      """
+      self.metrics.ended = time.time()
+      summary = self.metrics.summary()
+      print(
+         'MEDUSA: INFO: Metrics - Tasks=%s, Jobs=%s, Tasks/s=%.1f, p50=%.4fs, p99=%.4fs, '
+         'QueueDepthMax=%s' % (
+            summary['tasks'], summary['jobs'], summary['tasks_per_sec'],
+            summary['latency_p50'], summary['latency_p99'], summary['queue_depth_max']
+         )
+      )
+      if DEBUG:
+         for worker in self.metrics.worker_records():
+            print('MEDUSA: DEBUG: Worker metrics %s' % worker)
+      path = self.METRICS_FILE
+      if self.METRICS == 'jsonl':
+         path = path or self.RESULTS_DIR + '/' + self.RESULTS_FNAME + '.metrics.jsonl'
+         self.metrics.write_jsonl(path, self.PYMOD_NAME)
+      else:
+         path = path or self.RESULTS_DIR + '/' + self.RESULTS_FNAME + '.prom'
+         self.metrics.write_prometheus(path, self.PYMOD_NAME)
+      print('MEDUSA: INFO: Metrics written to %s' % path)
+
    def run_pre(self):
       pass
 
@@ -334,14 +3705,17 @@ class Medusa(object):
    def configure_post(self):
       pass
 
-   def orchestrate(self, processes=None, job_index=[]):
+   def orchestrate(self, processes=None, job_index=[], resume=False):
       """Orchestrate the parallel job.
+         job_index may be a list or any iterable, iterables without a length (generators,
+         file handles, database cursors) are streamed through the dynamic scheduler.
+         resume=True continues a failed journaled run, jobs it completed are skipped.
       """
       try:
          self.configure(processes)
          self.configure_post()
 
-         self.prepare(job_index)
+         self.prepare(job_index, resume)
 
          self.run_pre()
          self.run()
@@ -358,6 +3732,70 @@ class Medusa(object):
          sys.exit(1)
 
 
+class Pipeline(object):
+   """
+      Medusa stages that run at the same time, each on its own pool of its own PROCESSES.
+      The records of every stage but the last go from its collect() into a StageBuffer that
+      is the streamed job_index of the next stage, so stages overlap and intermediates stay
+      in memory. Stages but the last run in memory mode, the last keeps its RESULTS_MODE.
+   """
+   def __init__(self, stages, buffer=PIPELINE_BUFFER, spill=PIPELINE_SPILL):
+      self.stages = list(stages)
+      self.buffer = buffer
+      self.spill = spill
+      self.buffers = []
+      shared = [stage for stage in self.stages if stage.BACKEND in ('thread', 'serial')]
+      if shared.__len__() > 1:
+         # In process backends install their stage as the one worker instance of the parent
+         raise ValueError('At most one pipeline stage can use the thread or serial backend.')
+
+   def run(self, job_index=[]):
+      """
+         Stream job_index through every stage and return the last one. The first error of a
+         stage stops the others and is raised once all of them returned.
+      """
+      stages = self.stages
+      self.buffers = [StageBuffer(self.buffer, self.spill, stage.TEMP) for stage in stages[:-1]]
+      errors = []
+
+      def run_stage(index):
+         stage = stages[index]
+         last = index == stages.__len__() - 1
+         mode = stage.RESULTS_MODE
+         try:
+            if not last:
+               stage.RESULTS_MODE = 'memory'
+               stage.sink = self.buffers[index].put
+            stage.orchestrate(
+               processes=stage.PROCESSES,
+               job_index=job_index if index == 0 else self.buffers[index - 1]
+            )
+            if not last:
+               self.buffers[index].close()
+         except BaseException as e:
+            errors.append((index, e))
+            for buffer in self.buffers:
+               buffer.abort()
+         finally:
+            stage.RESULTS_MODE = mode
+            stage.sink = None
+
+      threads = [
+         threading.Thread(target=run_stage, args=(index, ), name='medusa-stage-%s' % index)
+         for index in range(stages.__len__())
+      ]
+      for thread in threads:
+         thread.start()
+      for thread in threads:
+         thread.join()
+      for index, buffer in enumerate(self.buffers):
+         if buffer.spilled:
+            print('MEDUSA: INFO: Pipeline stage %s spilled %s records.' % (index, buffer.spilled))
+      if errors:
+         raise min(errors, key=lambda error: error[0])[1]
+      return stages[-1]
+
+
 class MedusaTestJob(Medusa):
    def __init__(self):
       # We want the super class's initialisation method to be called
@@ -369,26 +3807,35 @@ class MedusaTestJob(Medusa):
    def run_pre(self):
       print('*** START OF JOB - We are now ready to run our parallel orchestration.')
 
+   def worker_init(self):
+      # Runs once per worker process, worker_custom checks it happened in this process
+      self.WORKER_INIT_PID = os.getpid()
+
    def worker_custom(self, job_data):
       """ Mandatory overriden procedure.
           We override this for custom instance processing.
       """
       pid = os.getpid()
-      wname = self.TEMP + '/worker.%s' % pid
+      wname = self.shard_path()
       print('Starting worker file %s...' % wname)
+      if getattr(self, 'WORKER_INIT_PID', None) != pid:
+         raise RuntimeError('worker_init() did not run in worker %s' % pid)
 
       # We open a file and can write our results here for later joining
       # We run an enrichment unit of work as a separate python3 daemon process so that pandas
       # has its own memory space reducing dataframe merging errors and malformation
-      afile = open(wname, 'a')
+      afile = self.result_writer() if self.RESULTS_MODE == 'file' else None
+      add = self.shared('add')[0] if 'add' in self.SHARED else 2
+      values = []
       row_result = None
       print('DEBUG: job_data=%s' % job_data)
       for row in job_data:
          try:
             # Process rows
-            print('%s - Processing Orchestration %s ' % (wname, row))
+            if VERBOSE:
+               print('%s - Processing Orchestration %s ' % (wname, row))
             row_result = None
-            row_result = 2 + int(row)  # Add two
+            row_result = add + int(row)  # Add two
          except Exception as e:
             print(
                'Exception for job ' + row + ', ERR - \n' + str(traceback.format_exc()) + '\n' +
@@ -401,25 +3848,41 @@ class MedusaTestJob(Medusa):
             row_result = 'ERROR: Could not enrich job ' + row
 
          # Write job result for later analysis
-         afile.write(str(row_result) + ',\n')
-         print('%s - Job Result - \n %s ' % (wname, row_result))
+         if afile is None:
+            values.append(row_result)
+         else:
+            afile.write(row_result)
+         if VERBOSE:
+            print('%s - Job Result - \n %s ' % (wname, row_result))
 
-      afile.close()
       print('Ended  worker file %s' % wname)
+      if afile is None:
+         # Memory mode, the records go back to the parent as the return value
+         return values
+      afile.close()
       return (pid, )
 
+   def map(self, job):
+      # Reduce mode, the same add two as worker_custom, summed by the default combine()
+      return int(job) + 2
+
+   async def worker_custom_async(self, job):
+      # Async mode, one coroutine per job, the sleep stands in for a network round trip
+      if getattr(self, 'WORKER_INIT_PID', None) != os.getpid():
+         raise RuntimeError('worker_init() did not run in worker %s' % os.getpid())
+      import asyncio
+      await asyncio.sleep(0.01)
+      return int(job) + 2
+
    def run_post(self):
       print('*** END OF JOB - Workers finished processing.')
       print('*** Results file is located here ' + self.results_file)
       # Do what ever you want with the results here
       # After this method, a clean up of temp will be performed.
-      with open(self.results_file) as r:
-         r = eval(r.read())
-         print('*** RESULT - ' + str(r))
-         self.TEST_RESULT = int(r[0])
-         for i in r[1:]:
-            # Deduct values via product
-            self.TEST_RESULT = int(self.TEST_RESULT) + int(i)
+      self.TEST_RESULT = 0
+      for i in self.iter_results():
+         self.TEST_RESULT = self.TEST_RESULT + int(i)
+      print('*** RESULT - ' + str(self.TEST_RESULT))
 
 
 def test():
@@ -432,18 +3895,41 @@ def test():
    DEBUG = True
    VERBOSE = True
    # Batch modules and settings
+   import shutil
+   import socket
+   import tempfile
+   import subprocess
    try:
       import rlab_common as rlcom
    except Exception:
       print('WARNING: Test case requires rlab_common module. Skipping tests.')
       sys.exit(0)
+
+   # Fault injection for the retry, resume, timeout and speculative tests, the task holding
+   # FAIL_JOB fails and the one holding SLOW_JOB hangs, once per FAIL_MARKER file
+   class FaultTestJob(MedusaTestJob):
+      FAIL_JOB = None
+      SLOW_JOB = None
+      FAIL_MARKER = None
+
+      def worker_custom(self, job_data):
+         if self.FAIL_MARKER is not None and os.path.exists(self.FAIL_MARKER):
+            if self.FAIL_JOB is not None and self.FAIL_JOB in job_data:
+               os.remove(self.FAIL_MARKER)
+               raise RuntimeError('Injected failure for job %s' % self.FAIL_JOB)
+            if self.SLOW_JOB is not None and self.SLOW_JOB in job_data:
+               os.remove(self.FAIL_MARKER)
+               time.sleep(60)
+         return super().worker_custom(job_data)
+
    # Run Test Medusa Abstraction
-   test_obj = MedusaTestJob()
+   test_obj = FaultTestJob()
    # We rely on ~/.worker-template.conf to adjust concurrent jobs without rebuilding the wheel
    # We default to 1 so that the user session config can be modified
    test_obj.TEMP = TEMP
    test_obj.PROCESSES = 4  # Default: 10 | Set to none to let the json conf file control it
    test_obj.WORKER_TIMEOUT = 72000
+   test_obj_timeout = test_obj.WORKER_TIMEOUT
    test_obj.WORKER_EXIT_ON_TIMEOUT = True  # TODO: In production this should be True
    test_obj.PYMOD_NAME = 'MedusaTestJob'
    test_obj.RESULTS_FNAME = 'results-' + test_obj.PYMOD_NAME + '-' + rlcom.filesys().whoami()
@@ -536,6 +4022,846 @@ def test():
    else:
       print('Testing MedusaTestJob - LARGE JOB - Odd.......OK')
 
+   # Dynamic Scheduler Test - Odd
+   print('Testing MedusaTestJob - DYNAMIC JOB - Odd.......')
+   job_data = [x for x in range(0, 2001)]  # Test data per unit of work
+   expected = 0
+   for i in job_data:
+      expected = expected + i + 2    # Expected result
+   print('**** Number of jobs ' + str(job_data.__len__()))
+   r = test_obj
+   r.SCHEDULER = 'dynamic'
+   r.orchestrate(processes=4, job_index=job_data)
+   r.SCHEDULER = SCHEDULER
+   result = r.TEST_RESULT
+   print('TEST > DEBUG: MedusaTestJob.TEST_RESULT=%s' % (result,))
+   if expected != result:
+      print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s' % (expected, result))
+      print('Testing MedusaTestJob - DYNAMIC JOB - Odd.......FAILED')
+      sys.exit(1)
+   else:
+      print('Testing MedusaTestJob - DYNAMIC JOB - Odd.......OK')
+
+   # Streamed Job Test - job_index is a generator without a length
+   print('Testing MedusaTestJob - STREAMED JOB.......')
+   job_data = (x for x in range(0, 2001))  # Test data per unit of work
+   expected = 0
+   for i in range(0, 2001):
+      expected = expected + i + 2    # Expected result
+   r = test_obj
+   r.orchestrate(processes=4, job_index=job_data)
+   result = r.TEST_RESULT
+   print('TEST > DEBUG: MedusaTestJob.TEST_RESULT=%s' % (result,))
+   if expected != result:
+      print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s' % (expected, result))
+      print('Testing MedusaTestJob - STREAMED JOB.......FAILED')
+      sys.exit(1)
+   else:
+      print('Testing MedusaTestJob - STREAMED JOB.......OK')
+
+   # Binary Result Format Test
+   for fmt in RESULT_FORMATS[1:]:
+      print('Testing MedusaTestJob - %s RESULTS.......' % fmt)
+      try:
+         get_codec(fmt)
+      except ImportError:
+         print('Testing MedusaTestJob - %s RESULTS.......SKIPPED' % fmt)
+         continue
+      job_data = [x for x in range(0, 1000)]  # Test data per unit of work
+      expected = 0
+      for i in job_data:
+         expected = expected + i + 2    # Expected result
+      r = test_obj
+      r.RESULT_FORMAT = fmt
+      r.MERGE_THREADS = 4
+      r.orchestrate(processes=4, job_index=job_data)
+      r.RESULT_FORMAT = RESULT_FORMAT
+      r.MERGE_THREADS = MERGE_THREADS
+      result = r.TEST_RESULT
+      if expected != result:
+         print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s' % (expected, result))
+         print('Testing MedusaTestJob - %s RESULTS.......FAILED' % fmt)
+         sys.exit(1)
+      else:
+         print('Testing MedusaTestJob - %s RESULTS.......OK' % fmt)
+
+   # Compressed Result Test - workers compress their shards, the merged file is read back as
+   # a stream and gzip text results are a json list to the standard gzip module as well
+   for compression, fmt in itertools.product(RESULT_COMPRESSIONS[1:], RESULT_FORMATS[:2]):
+      print('Testing MedusaTestJob - %s %s RESULTS.......' % (compression, fmt))
+      try:
+         get_compression(compression)
+      except ImportError:
+         print('Testing MedusaTestJob - %s %s RESULTS.......SKIPPED' % (compression, fmt))
+         continue
+      job_data = [x for x in range(0, 1000)]  # Test data per unit of work
+      expected = 0
+      for i in job_data:
+         expected = expected + i + 2    # Expected result
+      r = test_obj
+      r.RESULT_FORMAT = fmt
+      r.RESULT_COMPRESSION = compression
+      r.MERGE_THREADS = 4
+      r.orchestrate(processes=4, job_index=job_data)
+      r.RESULT_FORMAT = RESULT_FORMAT
+      r.RESULT_COMPRESSION = RESULT_COMPRESSION
+      r.MERGE_THREADS = MERGE_THREADS
+      result = r.TEST_RESULT
+      plain = expected
+      if compression == 'gzip' and fmt == 'text':
+         import gzip
+         with gzip.open(r.results_file) as gz:
+            plain = sum(json.load(gz))
+      if expected != result or expected != plain:
+         print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s, plain=%s' % (
+            expected, result, plain
+         ))
+         print('Testing MedusaTestJob - %s %s RESULTS.......FAILED' % (compression, fmt))
+         sys.exit(1)
+      else:
+         print('Testing MedusaTestJob - %s %s RESULTS.......OK' % (compression, fmt))
+
+   # Memory Result Channel Test - within budget, then spooled past a tiny budget with every
+   # backend, in-process ones hand over their lists unpickled
+   cases = ((RESULTS_MEMORY_LIMIT, 'process'), (64, 'process'), (64, 'thread'), (64, 'serial'))
+   for limit, backend in cases:
+      print('Testing MedusaTestJob - MEMORY RESULTS limit=%s %s.......' % (limit, backend))
+      job_data = [x for x in range(0, 1000)]  # Test data per unit of work
+      expected = 0
+      for i in job_data:
+         expected = expected + i + 2    # Expected result
+      r = test_obj
+      r.RESULTS_MODE = 'memory'
+      r.RESULTS_MEMORY_LIMIT = limit
+      r.BACKEND = backend
+      r.SCHEDULER = 'dynamic'
+      r.orchestrate(processes=4, job_index=job_data)
+      r.RESULTS_MODE = RESULTS_MODE
+      r.RESULTS_MEMORY_LIMIT = RESULTS_MEMORY_LIMIT
+      r.BACKEND = BACKEND
+      r.SCHEDULER = SCHEDULER
+      result = r.TEST_RESULT
+      count = r.results.__len__()
+      spooled = r.results.spooled
+      if expected != result or count != job_data.__len__() or spooled != (limit == 64):
+         print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s, spooled=%s' % (
+            expected, result, spooled
+         ))
+         print('Testing MedusaTestJob - MEMORY RESULTS limit=%s %s.......FAILED' % (
+            limit, backend
+         ))
+         sys.exit(1)
+      else:
+         print('Testing MedusaTestJob - MEMORY RESULTS limit=%s %s.......OK' % (limit, backend))
+
+   # Shared Memory Test - the value to add is published once and attached by every worker
+   print('Testing MedusaTestJob - SHARED MEMORY.......')
+   job_data = [x for x in range(0, 1000)]  # Test data per unit of work
+   expected = 0
+   for i in job_data:
+      expected = expected + i + 2    # Expected result
+   r = test_obj
+   r.share('add', array.array('q', [2]))
+   r.orchestrate(processes=4, job_index=job_data)
+   r.unshare('add')
+   result = r.TEST_RESULT
+   if expected != result or r.SHARED:
+      print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s' % (expected, result))
+      print('Testing MedusaTestJob - SHARED MEMORY.......FAILED')
+      sys.exit(1)
+   else:
+      print('Testing MedusaTestJob - SHARED MEMORY.......OK')
+
+   # Placement Test - every worker takes a slot and is pinned to its CPUs, the shared input
+   # has a copy per NUMA node on multi node hosts
+   for affinity in AFFINITIES[1:]:
+      print('Testing MedusaTestJob - AFFINITY %s.......' % affinity)
+      job_data = [x for x in range(0, 1000)]  # Test data per unit of work
+      expected = 0
+      for i in job_data:
+         expected = expected + i + 2    # Expected result
+      r = test_obj
+      r.AFFINITY = affinity
+      r.NUMA_SHARED = True
+      r.share('add', array.array('q', [2]))
+      r.orchestrate(processes=4, job_index=job_data)
+      r.unshare('add')
+      placed = r.get_placed()
+      plan = get_placement(4, affinity, PLACEMENT)
+      r.AFFINITY = AFFINITY
+      r.NUMA_SHARED = NUMA_SHARED
+      result = r.TEST_RESULT
+      if expected != result or sorted(p[1:] for p in placed) != sorted(plan):
+         print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s, placed=%s' % (
+            expected, result, placed
+         ))
+         print('Testing MedusaTestJob - AFFINITY %s.......FAILED' % affinity)
+         sys.exit(1)
+      else:
+         print('Testing MedusaTestJob - AFFINITY %s.......OK' % affinity)
+   # Placement plans of a two node host
+   nodes = {0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}
+   plans = (
+      [n for n, c in get_placement(4, 'core', 'spread', nodes)],
+      [c for n, c in get_placement(3, 'core', 'pack', nodes)],
+      get_placement(1, 'node', 'spread', nodes),
+      _format_cpulist(_parse_cpulist('0-2,8'))
+   )
+   if plans != ([0, 1, 0, 1], [(0, ), (1, ), (2, )], [(0, (0, 1, 2, 3))], '0-2,8'):
+      print('TEST > ERROR: MedusaTestJob> plans=%s' % (plans, ))
+      print('Testing MedusaTestJob - PLACEMENT.......FAILED')
+      sys.exit(1)
+   print('Testing MedusaTestJob - PLACEMENT.......OK')
+
+   # Lifecycle Test - what run_pre() sets up reaches the workers of the pool orchestrate() opens
+   class RunPreJob(MedusaTestJob):
+      ADD = None
+
+      def run_pre(self):
+         self.ADD = 3
+
+      def worker_custom(self, job_data):
+         with self.result_writer() as w:
+            for row in job_data:
+               w.write(int(row) + self.ADD)
+         return (os.getpid(), )
+
+   print('Testing MedusaTestJob - RUN PRE.......')
+   job_data = [x for x in range(0, 1000)]  # Test data per unit of work
+   expected = 0
+   for i in job_data:
+      expected = expected + i + 3    # Expected result
+   r = RunPreJob()
+   for name in ('TEMP', 'PYMOD_NAME', 'RESULTS_FNAME', 'RESULTS_DIR', 'CONFIG_FNAME'):
+      setattr(r, name, getattr(test_obj, name))
+   r.orchestrate(processes=4, job_index=job_data)
+   result = r.TEST_RESULT
+   if expected != result:
+      print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s' % (expected, result))
+      print('Testing MedusaTestJob - RUN PRE.......FAILED')
+      sys.exit(1)
+   else:
+      print('Testing MedusaTestJob - RUN PRE.......OK')
+
+   # Thread Shard Test - a thread worker writing to TEMP/worker.<pid> fails the run, its records
+   # would not be merged
+   class PidShardJob(MedusaTestJob):
+      def worker_custom(self, job_data):
+         with open(self.TEMP + '/worker.%s' % os.getpid(), 'a') as afile:
+            for row in job_data:
+               afile.write('%s,\n' % (int(row) + 2))
+         return (os.getpid(), )
+
+   print('Testing MedusaTestJob - THREAD PID SHARD.......')
+   r = PidShardJob()
+   for name in ('TEMP', 'PYMOD_NAME', 'RESULTS_FNAME', 'RESULTS_DIR', 'CONFIG_FNAME'):
+      setattr(r, name, getattr(test_obj, name))
+   r.BACKEND = 'thread'
+   try:
+      r.orchestrate(processes=4, job_index=[x for x in range(0, 100)])
+      failed = False
+   except SystemExit:
+      failed = True
+   orphan = r.shard_path(os.getpid())
+   if os.path.exists(orphan):
+      os.remove(orphan)
+   if not failed:
+      print('Testing MedusaTestJob - THREAD PID SHARD.......FAILED')
+      sys.exit(1)
+   else:
+      print('Testing MedusaTestJob - THREAD PID SHARD.......OK')
+
+   # Pipeline Test - the add two records of a 3 worker stage stream into a 2 worker stage that
+   # adds two again, then the same with no buffer so that every batch spills to disk
+   for spill in (False, True):
+      print('Testing MedusaTestJob - PIPELINE spill=%s.......' % spill)
+      job_data = [x for x in range(0, 1000)]  # Test data per unit of work
+      expected = 0
+      for i in job_data:
+         expected = expected + i + 4    # Expected result
+      stages = [MedusaTestJob(), MedusaTestJob()]
+      for index, stage in enumerate(stages):
+         stage.TEMP = TEMP
+         stage.PROCESSES = 3 - index
+         stage.PYMOD_NAME = 'MedusaTestJob-stage%s' % index
+         stage.RESULTS_FNAME = test_obj.RESULTS_FNAME + '-stage%s' % index
+         stage.RESULTS_DIR = test_obj.RESULTS_DIR
+         stage.CONFIG_FNAME = test_obj.CONFIG_FNAME
+         stage.SCHEDULER = 'dynamic'
+         stage.DISPATCH_CHUNK_MAX = 20
+      pipeline = Pipeline(stages, buffer=0 if spill else 1000, spill=spill)
+      r = pipeline.run(job_data)
+      result = r.TEST_RESULT
+      spilled = pipeline.buffers[0].spilled
+      placed = [stage.PROCESSES for stage in stages]
+      modes = [stage.RESULTS_MODE for stage in stages]
+      restored = modes == [RESULTS_MODE, RESULTS_MODE]
+      if expected != result or placed != [3, 2] or bool(spilled) != spill or not restored:
+         print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s, spilled=%s, modes=%s' % (
+            expected, result, spilled, modes
+         ))
+         print('Testing MedusaTestJob - PIPELINE spill=%s.......FAILED' % spill)
+         sys.exit(1)
+      else:
+         print('Testing MedusaTestJob - PIPELINE spill=%s.......OK' % spill)
+
+   # Retry Test - job 500 fails once and its task is resubmitted, the default static
+   # scheduler gives way to the dynamic one
+   print('Testing MedusaTestJob - TASK RETRY.......')
+   job_data = [x for x in range(0, 1000)]  # Test data per unit of work
+   expected = 0
+   for i in job_data:
+      expected = expected + i + 2    # Expected result
+   r = test_obj
+   r.FAIL_JOB = 500
+   r.FAIL_MARKER = TEMP + '/medusa-test-fail-' + str(os.getpid())
+   open(r.FAIL_MARKER, 'w').close()
+   r.TASK_RETRIES = 1
+   r.orchestrate(processes=4, job_index=job_data)
+   r.TASK_RETRIES = TASK_RETRIES
+   result = r.TEST_RESULT
+   if expected != result or os.path.exists(r.FAIL_MARKER):
+      print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s' % (expected, result))
+      print('Testing MedusaTestJob - TASK RETRY.......FAILED')
+      sys.exit(1)
+   else:
+      print('Testing MedusaTestJob - TASK RETRY.......OK')
+
+   # Resume Test - job 500 fails a journaled run, the resumed run only does what is left
+   print('Testing MedusaTestJob - JOURNAL RESUME.......')
+   open(r.FAIL_MARKER, 'w').close()
+   r.JOURNAL = True
+   try:
+      r.orchestrate(processes=4, job_index=job_data)
+      interrupted = False
+   except SystemExit:
+      interrupted = True
+   r.orchestrate(processes=4, job_index=job_data, resume=True)
+   remaining = r.JOB_COUNT
+   r.JOURNAL = JOURNAL
+   r.SCHEDULER = SCHEDULER
+   r.FAIL_JOB = None
+   result = r.TEST_RESULT
+   if not interrupted or remaining >= job_data.__len__() or expected != result:
+      print(
+         'TEST > ERROR: MedusaTestJob> expected=%s, result=%s, interrupted=%s, remaining=%s' % (
+            expected, result, interrupted, remaining
+         )
+      )
+      print('Testing MedusaTestJob - JOURNAL RESUME.......FAILED')
+      sys.exit(1)
+   else:
+      print('Testing MedusaTestJob - JOURNAL RESUME.......OK')
+
+   # Lost Shards Test - TEMP is wiped between the failed run and the resume, the journaled jobs
+   # have no output left and run again
+   print('Testing MedusaTestJob - JOURNAL RESUME LOST SHARDS.......')
+   open(r.FAIL_MARKER, 'w').close()
+   r.JOURNAL = True
+   r.FAIL_JOB = 500
+   r.TEMP = tempfile.mkdtemp()
+   try:
+      r.orchestrate(processes=4, job_index=job_data)
+   except SystemExit:
+      pass
+   shutil.rmtree(r.TEMP)
+   os.makedirs(r.TEMP)
+   r.orchestrate(processes=4, job_index=job_data, resume=True)
+   remaining = r.JOB_COUNT
+   shutil.rmtree(r.TEMP)
+   r.TEMP = TEMP
+   r.JOURNAL = JOURNAL
+   r.SCHEDULER = SCHEDULER
+   r.FAIL_JOB = None
+   result = r.TEST_RESULT
+   if remaining != job_data.__len__() or expected != result:
+      print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s, remaining=%s' % (
+         expected, result, remaining
+      ))
+      print('Testing MedusaTestJob - JOURNAL RESUME LOST SHARDS.......FAILED')
+      sys.exit(1)
+   else:
+      print('Testing MedusaTestJob - JOURNAL RESUME LOST SHARDS.......OK')
+
+   # Weighted Partitioning Test - LPT tasks, weights learned by the first run, the static
+   # scheduler gives way to the dynamic one
+   for scheduler in SCHEDULERS:
+      print('Testing MedusaTestJob - LPT PARTITIONER %s.......' % scheduler)
+      r = test_obj
+      r.PARTITIONER = 'lpt'
+      r.LEARN_WEIGHTS = True
+      r.SCHEDULER = scheduler
+      r.orchestrate(processes=4, job_index=job_data)
+      weights_file = r.get_weights_file()
+      learned = os.path.exists(weights_file)
+      r.orchestrate(processes=4, job_index=job_data)
+      r.PARTITIONER = PARTITIONER
+      r.LEARN_WEIGHTS = LEARN_WEIGHTS
+      r.SCHEDULER = SCHEDULER
+      if learned:
+         os.remove(weights_file)
+      result = r.TEST_RESULT
+      if expected != result or not learned:
+         print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s' % (expected, result))
+         print('Testing MedusaTestJob - LPT PARTITIONER %s.......FAILED' % scheduler)
+         sys.exit(1)
+      else:
+         print('Testing MedusaTestJob - LPT PARTITIONER %s.......OK' % scheduler)
+
+   # Metrics Test - both exporters, task counts must add up
+   for fmt in METRICS_FORMATS[1:]:
+      print('Testing MedusaTestJob - %s METRICS.......' % fmt)
+      r = test_obj
+      r.METRICS = fmt
+      r.METRICS_FILE = TEMP + '/medusa-test-metrics-' + str(os.getpid())
+      r.SCHEDULER = 'dynamic'
+      r.orchestrate(processes=4, job_index=job_data)
+      with open(r.METRICS_FILE) as m:
+         exported = m.read()
+      os.remove(r.METRICS_FILE)
+      summary = r.metrics.summary()
+      r.METRICS = METRICS
+      r.METRICS_FILE = METRICS_FILE
+      r.SCHEDULER = SCHEDULER
+      if summary['jobs'] != job_data.__len__() or 'tasks' not in exported:
+         print('TEST > ERROR: MedusaTestJob> metrics=%s' % (summary, ))
+         print('Testing MedusaTestJob - %s METRICS.......FAILED' % fmt)
+         sys.exit(1)
+      else:
+         print('Testing MedusaTestJob - %s METRICS.......OK' % fmt)
+
+   # Task Timeout Test - job 600 hangs once, its task times out and is retried, the default
+   # static scheduler gives way to the dynamic one
+   print('Testing MedusaTestJob - TASK TIMEOUT.......')
+   start = time.time()
+   open(r.FAIL_MARKER, 'w').close()
+   r.SLOW_JOB = 600
+   r.TASK_TIMEOUT = 2
+   r.TASK_RETRIES = 1
+   r.orchestrate(processes=4, job_index=job_data)
+   r.TASK_TIMEOUT = TASK_TIMEOUT
+   r.TASK_RETRIES = TASK_RETRIES
+   result = r.TEST_RESULT
+   if expected != result or time.time() - start > 30:
+      print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s' % (expected, result))
+      print('Testing MedusaTestJob - TASK TIMEOUT.......FAILED')
+      sys.exit(1)
+   else:
+      print('Testing MedusaTestJob - TASK TIMEOUT.......OK')
+
+   # Speculative Test - job 600 hangs once, a copy of its task runs on an idle worker
+   print('Testing MedusaTestJob - SPECULATIVE.......')
+   start = time.time()
+   open(r.FAIL_MARKER, 'w').close()
+   r.SPECULATIVE = True
+   r.orchestrate(processes=4, job_index=job_data)
+   r.SPECULATIVE = SPECULATIVE
+   r.SCHEDULER = SCHEDULER
+   r.SLOW_JOB = None
+   result = r.TEST_RESULT
+   if expected != result or r.speculated < 1 or time.time() - start > 30:
+      print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s' % (expected, result))
+      print('Testing MedusaTestJob - SPECULATIVE.......FAILED')
+      sys.exit(1)
+   else:
+      print('Testing MedusaTestJob - SPECULATIVE.......OK')
+
+   # Worker Timeout Test - job 600 hangs past WORKER_TIMEOUT, the run keeps what completed and
+   # returns without waiting for the hung task
+   print('Testing MedusaTestJob - WORKER TIMEOUT.......')
+   start = time.time()
+   open(r.FAIL_MARKER, 'w').close()
+   r.SLOW_JOB = 600
+   r.WORKER_TIMEOUT = 2
+   r.WORKER_EXIT_ON_TIMEOUT = False
+   # The tasks of the timed out round leave their shards behind, keep them out of TEMP
+   r.TEMP = tempfile.mkdtemp()
+   r.orchestrate(processes=4, job_index=job_data)
+   shutil.rmtree(r.TEMP)
+   r.TEMP = TEMP
+   r.WORKER_TIMEOUT = test_obj_timeout
+   r.WORKER_EXIT_ON_TIMEOUT = True
+   r.SLOW_JOB = None
+   elapsed = time.time() - start
+   if elapsed > 30 or r.TEST_RESULT >= expected:
+      print('TEST > ERROR: MedusaTestJob> elapsed=%s, result=%s' % (elapsed, r.TEST_RESULT))
+      print('Testing MedusaTestJob - WORKER TIMEOUT.......FAILED')
+      sys.exit(1)
+   else:
+      print('Testing MedusaTestJob - WORKER TIMEOUT.......OK')
+
+   # Async Worker Test - jobs run as coroutines, in both record channels
+   for mode in ('file', 'memory'):
+      print('Testing MedusaTestJob - ASYNC WORKERS %s.......' % mode)
+      job_data = [x for x in range(0, 2000)]  # Test data per unit of work
+      expected = 0
+      for i in job_data:
+         expected = expected + i + 2    # Expected result
+      start = time.time()
+      r = test_obj
+      r.ASYNC_WORKERS = True
+      r.ASYNC_CONCURRENCY = 50
+      r.RESULTS_MODE = mode
+      r.SCHEDULER = 'dynamic'
+      r.orchestrate(processes=4, job_index=job_data)
+      r.ASYNC_WORKERS = ASYNC_WORKERS
+      r.ASYNC_CONCURRENCY = ASYNC_CONCURRENCY
+      r.RESULTS_MODE = RESULTS_MODE
+      r.SCHEDULER = SCHEDULER
+      result = r.TEST_RESULT
+      # 2000 jobs of 10ms on 4 processes take 5s one at a time
+      if expected != result or time.time() - start > 4:
+         print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s' % (expected, result))
+         print('Testing MedusaTestJob - ASYNC WORKERS %s.......FAILED' % mode)
+         sys.exit(1)
+      else:
+         print('Testing MedusaTestJob - ASYNC WORKERS %s.......OK' % mode)
+
+   # Reduce Test - per task partial sums folded in the parent as they arrive, no shard files
+   for scheduler in SCHEDULERS:
+      print('Testing MedusaTestJob - REDUCE %s.......' % scheduler)
+      job_data = [x for x in range(0, 2001)]  # Test data per unit of work
+      expected = 0
+      for i in job_data:
+         expected = expected + i + 2    # Expected result
+      r = test_obj
+      r.RESULTS_MODE = 'reduce'
+      r.SCHEDULER = scheduler
+      shards = set(glob.glob(r.shard_path('*')))
+      r.orchestrate(processes=4, job_index=job_data)
+      r.RESULTS_MODE = RESULTS_MODE
+      r.SCHEDULER = SCHEDULER
+      result = r.TEST_RESULT
+      if expected != result or shards != set(glob.glob(r.shard_path('*'))):
+         print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s' % (expected, result))
+         print('Testing MedusaTestJob - REDUCE %s.......FAILED' % scheduler)
+         sys.exit(1)
+      else:
+         print('Testing MedusaTestJob - REDUCE %s.......OK' % scheduler)
+
+   # Memory Test - every task leaves its worker over a 1 byte RSS limit so each is recycled,
+   # then an unreachable available memory floor runs one task at a time
+   for name, value in (('WORKER_RSS_LIMIT', 1), ('WORKER_MAX_TASKS', 2),
+                       ('MEMORY_MIN_AVAILABLE', 1 << 62)):
+      print('Testing MedusaTestJob - MEMORY %s.......' % name)
+      job_data = [x for x in range(0, 1000)]  # Test data per unit of work
+      expected = 0
+      for i in job_data:
+         expected = expected + i + 2    # Expected result
+      r = test_obj
+      setattr(r, name, value)
+      r.SCHEDULER = 'dynamic'
+      r.DISPATCH_CHUNK_MAX = 50
+      r.orchestrate(processes=4, job_index=job_data)
+      setattr(r, name, globals()[name])
+      r.SCHEDULER = SCHEDULER
+      r.DISPATCH_CHUNK_MAX = DISPATCH_CHUNK_MAX
+      result = r.TEST_RESULT
+      events = r.throttled if name == 'MEMORY_MIN_AVAILABLE' else r.recycled
+      if expected != result or not events or not _task_budget_works():
+         print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s, events=%s' % (
+            expected, result, events
+         ))
+         print('Testing MedusaTestJob - MEMORY %s.......FAILED' % name)
+         sys.exit(1)
+      else:
+         print('Testing MedusaTestJob - MEMORY %s.......OK' % name)
+
+   # Autotune Test - a warm-up search is stored, the next run starts from it
+   print('Testing MedusaTestJob - AUTOTUNE.......')
+   job_data = [x for x in range(0, 5000)]  # Test data per unit of work
+   expected = 0
+   for i in job_data:
+      expected = expected + i + 2    # Expected result
+   r = test_obj
+   r.AUTOTUNE = True
+   r.AUTOTUNE_FILE = os.path.join(tempfile.mkdtemp(), 'autotune.yaml')
+   r.AUTOTUNE_CHUNKS = (4, 16, 64)
+   r.orchestrate(processes=4, job_index=job_data)
+   results = [r.TEST_RESULT]
+   tuned = r.read_autotune().get(r.PYMOD_NAME) or {}
+   r.orchestrate(processes=4, job_index=job_data)
+   results.append(r.TEST_RESULT)
+   searched = r.tuner is not None
+   # A 64 CPU search in 1000 warm-up jobs keeps the small task sizes and the worker phase
+   tuner = Autotuner(64, (1, 4, 16, 64, 256), 2)
+   tuner.plan(1000)
+   plan = (tuner.samples, tuner.skipped, tuner.current, tuner.candidates, tuner.workers)
+   searched = searched or plan != (1, [(64, 256), (64, 64), (64, 16)], (64, 1), [(64, 4)],
+                                   [32, 16])
+   shutil.rmtree(os.path.dirname(r.AUTOTUNE_FILE))
+   r.AUTOTUNE = AUTOTUNE
+   r.AUTOTUNE_FILE = AUTOTUNE_FILE
+   r.AUTOTUNE_CHUNKS = AUTOTUNE_CHUNKS
+   r.DISPATCH_CHUNK_MIN = DISPATCH_CHUNK_MIN
+   r.DISPATCH_CHUNK_MAX = DISPATCH_CHUNK_MAX
+   if results != [expected, expected] or tuned.get('chunk') not in (4, 16, 64) or searched:
+      print('TEST > ERROR: MedusaTestJob> expected=%s, results=%s, tuned=%s, plan=%s' % (
+         expected, results, tuned, plan
+      ))
+      print('Testing MedusaTestJob - AUTOTUNE.......FAILED')
+      sys.exit(1)
+   else:
+      print('Testing MedusaTestJob - AUTOTUNE.......OK')
+
+   # Cache Test - a second run over overlapping jobs only computes the new half, then
+   # everything is evicted past a zero size cap
+   for mode in RESULTS_MODES:
+      print('Testing MedusaTestJob - CACHE %s.......' % mode)
+      r = test_obj
+      r.CACHE = True
+      r.CACHE_DIR = tempfile.mkdtemp()
+      r.RESULTS_MODE = mode
+      r.orchestrate(processes=4, job_index=[x for x in range(0, 1000)])
+      job_data = [x for x in range(500, 1500)]  # Test data per unit of work
+      expected = 0
+      for i in job_data:
+         expected = expected + i + 2    # Expected result
+      r.orchestrate(processes=4, job_index=job_data)
+      hits, misses = r.cache.hits, r.cache.misses
+      # Another instance sharing TEMP serves its hits from a shard of its own
+      other = MedusaTestJob()
+      other.TEMP = r.TEMP
+      distinct = other.cache_shard_path() != r.cache_shard_path()
+      r.cache.size = 0
+      left = r.cache.evict()
+      shutil.rmtree(r.CACHE_DIR)
+      r.CACHE = CACHE
+      r.CACHE_DIR = CACHE_DIR
+      r.RESULTS_MODE = RESULTS_MODE
+      result = r.TEST_RESULT
+      if expected != result or hits != 500 or misses != 500 or left != 0 or not distinct:
+         print(
+            'TEST > ERROR: MedusaTestJob> expected=%s, result=%s, hits=%s, misses=%s' % (
+               expected, result, hits, misses
+            )
+         )
+         print('Testing MedusaTestJob - CACHE %s.......FAILED' % mode)
+         sys.exit(1)
+      else:
+         print('Testing MedusaTestJob - CACHE %s.......OK' % mode)
+
+   # Incremental Test - each run only adds the part of its new jobs, jobs that left the
+   # index drop out of the result set and fully dead parts are removed
+   for fmt in RESULT_FORMATS[:2]:
+      print('Testing MedusaTestJob - INCREMENTAL %s.......' % fmt)
+      r = test_obj
+      r.INCREMENTAL = True
+      r.RESULT_FORMAT = fmt
+      r.RESULTS_DIR = tempfile.mkdtemp()
+      parts = []
+      for first in (0, 500, 500, 1000):
+         job_data = [x for x in range(first, first + 1000)]  # Test data per unit of work
+         r.orchestrate(processes=4, job_index=job_data)
+         parts.append(sorted(os.listdir(r.RESULTS_DIR + '/' + r.RESULTS_FNAME + '.parts')))
+      shutil.rmtree(r.RESULTS_DIR)
+      r.INCREMENTAL = INCREMENTAL
+      r.RESULT_FORMAT = RESULT_FORMAT
+      r.RESULTS_DIR = '/tmp'
+      expected = 0
+      for i in job_data:
+         expected = expected + i + 2    # Expected result
+      result = r.TEST_RESULT
+      history = [
+         ['part-000000'], ['part-000000', 'part-000001'], ['part-000000', 'part-000001'],
+         ['part-000001', 'part-000002']
+      ]
+      if expected != result or parts != history:
+         print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s, parts=%s' % (
+            expected, result, parts
+         ))
+         print('Testing MedusaTestJob - INCREMENTAL %s.......FAILED' % fmt)
+         sys.exit(1)
+      else:
+         print('Testing MedusaTestJob - INCREMENTAL %s.......OK' % fmt)
+
+   # Batch Mode Test - numeric jobs in shared memory, tasks are array slices
+   for backend in ('process', 'thread'):
+      print('Testing MedusaTestJob - BATCH MODE %s.......' % backend)
+      job_data = [x for x in range(0, 2001)]  # Test data per unit of work
+      expected = 0
+      for i in job_data:
+         expected = expected + i + 2    # Expected result
+      r = test_obj
+      r.BATCH_MODE = True
+      r.BACKEND = backend
+      r.orchestrate(processes=4, job_index=job_data)
+      r.BATCH_MODE = BATCH_MODE
+      r.BACKEND = BACKEND
+      result = r.TEST_RESULT
+      if expected != result or BATCH_JOBS in r.SHARED:
+         print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s' % (expected, result))
+         print('Testing MedusaTestJob - BATCH MODE %s.......FAILED' % backend)
+         sys.exit(1)
+      else:
+         print('Testing MedusaTestJob - BATCH MODE %s.......OK' % backend)
+
+   # Executor Backend Test - threads and serial, both schedulers and result channels
+   for backend in ('thread', 'serial'):
+      for scheduler in SCHEDULERS:
+         for mode in RESULTS_MODES:
+            name = '%s BACKEND %s %s' % (backend, scheduler, mode)
+            print('Testing MedusaTestJob - %s.......' % name)
+            job_data = [x for x in range(0, 1000)]  # Test data per unit of work
+            expected = 0
+            for i in job_data:
+               expected = expected + i + 2    # Expected result
+            r = test_obj
+            r.BACKEND = backend
+            r.SCHEDULER = scheduler
+            r.RESULTS_MODE = mode
+            r.orchestrate(processes=4, job_index=job_data)
+            r.BACKEND = BACKEND
+            r.SCHEDULER = SCHEDULER
+            r.RESULTS_MODE = RESULTS_MODE
+            result = r.TEST_RESULT
+            if expected != result:
+               print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s' % (expected, result))
+               print('Testing MedusaTestJob - %s.......FAILED' % name)
+               sys.exit(1)
+            else:
+               print('Testing MedusaTestJob - %s.......OK' % name)
+
+   # Cold Start Test - importing medusa creates no files and loads no optional module
+   print('Testing medusa - COLD START.......')
+   before = set(os.listdir(tempfile.gettempdir()))
+   started = time.time()
+   optional = "{'yaml', 'rlab_common', 'asyncio', 'logging'}"
+   loaded = subprocess.run(
+      [sys.executable, '-c', 'import sys, medusa; print(sorted(set(sys.modules) & %s))' % optional],
+      cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.PIPE, check=True
+   ).stdout.decode().strip()
+   elapsed = time.time() - started
+   created = set(os.listdir(tempfile.gettempdir())) - before
+   created = [f for f in created if not f.startswith('medusa-results.')]
+   print('MEDUSA: INFO: import medusa took %.3fs, loaded=%s' % (elapsed, loaded))
+   if loaded != '[]' or created:
+      print('TEST > ERROR: medusa> loaded=%s, created=%s' % (loaded, created))
+      print('Testing medusa - COLD START.......FAILED')
+      sys.exit(1)
+   else:
+      print('Testing medusa - COLD START.......OK')
+
+   # Distributed Test - a coordinator and three local worker agents, the first agent is killed
+   # once tasks are running and the tasks it held are requeued on the others
+   print('Testing MedusaTestJob - DISTRIBUTED.......')
+   job_data = [x for x in range(0, 10000)]  # Test data per unit of work
+   expected = 0
+   for i in job_data:
+      expected = expected + i + 2    # Expected result
+   probe = socket.create_server(('127.0.0.1', 0))
+   port = probe.getsockname()[1]
+   probe.close()
+   authkey = os.urandom(16).hex()
+   env = dict(os.environ)
+   env.pop('MEDUSA_AUTHKEY', None)
+   refused = subprocess.run(
+      [sys.executable, os.path.abspath(__file__), 'worker', '--connect', '127.0.0.1:%s' % port],
+      env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+   ).returncode != 0
+   env['MEDUSA_AUTHKEY'] = authkey
+   agents = [
+      subprocess.Popen(
+         [sys.executable, os.path.abspath(__file__), 'worker', '--connect', '127.0.0.1:%s' % port,
+          '--processes', '2'], stdout=subprocess.DEVNULL, env=env
+      ) for agent in range(0, 3)
+   ]
+   # The agents import the class by name, a plain MedusaTestJob rather than the test subclass
+   r = MedusaTestJob()
+   for name in ('PYMOD_NAME', 'RESULTS_FNAME', 'RESULTS_DIR', 'CONFIG_FNAME'):
+      setattr(r, name, getattr(test_obj, name))
+   # The killed agent leaves its shards behind, keep them out of the shared temp folder
+   r.TEMP = tempfile.mkdtemp()
+   r.BACKEND = 'distributed'
+   r.DISTRIBUTED_ADDRESS = ('127.0.0.1', port)
+   r.DISTRIBUTED_AUTHKEY = authkey
+   r.SCHEDULER = 'dynamic'
+   r.DISPATCH_CHUNK_MAX = 20
+   finished = threading.Event()
+   killed = []
+
+   def kill_agent():
+      # Crash the first agent as soon as any worker has written a shard
+      while not finished.is_set():
+         if glob.glob(r.shard_path('*')):
+            agents[0].kill()
+            killed.append(agents[0].pid)
+            return
+         time.sleep(0.01)
+
+   killer = threading.Thread(target=kill_agent)
+   killer.start()
+   try:
+      r.orchestrate(processes=6, job_index=job_data)
+   finally:
+      finished.set()
+      killer.join()
+      for agent in agents:
+         agent.terminate()
+         agent.wait()
+   for f in glob.glob(r.TEMP + '/*'):
+      os.remove(f)
+   os.rmdir(r.TEMP)
+   result = r.TEST_RESULT
+   if expected != result or not killed or not refused:
+      print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s, killed=%s, refused=%s' % (
+         expected, result, killed, refused
+      ))
+      print('Testing MedusaTestJob - DISTRIBUTED.......FAILED')
+      sys.exit(1)
+   else:
+      print('Testing MedusaTestJob - DISTRIBUTED.......OK')
+
+   # Persistent Pool Test - the same workers serve several orchestrations
+   print('Testing MedusaTestJob - REUSED POOL.......')
+   job_data = [x for x in range(0, 51)]  # Test data per unit of work
+   expected = 0
+   for i in job_data:
+      expected = expected + i + 2    # Expected result
+   with test_obj as r:
+      for run in range(0, 3):
+         r.orchestrate(processes=4, job_index=job_data)
+         result = r.TEST_RESULT
+         if expected != result:
+            print('TEST > ERROR: MedusaTestJob> expected=%s, result=%s' % (expected, result))
+            print('Testing MedusaTestJob - REUSED POOL.......FAILED')
+            sys.exit(1)
+   print('Testing MedusaTestJob - REUSED POOL.......OK')
+
+
+def main():
+   """
+      medusa console script. `medusa worker --connect host:port` runs a worker agent for a
+      distributed coordinator, `medusa test` (the default) runs the self test.
+   """
+   import argparse
+   parser = argparse.ArgumentParser(prog='medusa', description='Medusa multi worker tools.')
+   commands = parser.add_subparsers(dest='command')
+   commands.add_parser('test', help='Run the self test.')
+   worker = commands.add_parser('worker', help='Run tasks for a distributed coordinator.')
+   worker.add_argument('--connect', required=True, metavar='HOST:PORT')
+   worker.add_argument('--processes', type=int, default=None, help='Defaults to the cpu count.')
+   worker.add_argument('--authkey', default=None, help='Defaults to $MEDUSA_AUTHKEY.')
+   worker.add_argument(
+      '--path', action='append', default=[],
+      help='Add a directory to sys.path so that the job classes can be imported.'
+   )
+   worker.add_argument(
+      '--linger', type=float, default=None,
+      help='Exit once no coordinator could be reached for this many seconds.'
+   )
+   args = parser.parse_args()
+   if args.command == 'worker':
+      host, port = args.connect.rsplit(':', 1)
+      sys.path[0:0] = args.path
+      try:
+         authkey = get_authkey(args.authkey)
+      except ValueError as e:
+         parser.error(str(e))
+      run_agent((host, int(port)), authkey, args.processes, args.linger)
+   else:
+      test()
+
 
 if __name__ == '__main__':
-   test()
+   main()